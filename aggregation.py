@@ -0,0 +1,155 @@
+"""Ingest-time traffic aggregation for DNS entries.
+
+Per-IP and per-domain counters (packets, bytes, first/last seen) are
+updated as entries arrive, so statistics endpoints never rescan the log
+buffer.  Memory stays bounded however many distinct IPs and domains show
+up: each table is a Space-Saving top-k summary that keeps exact counters
+for at most ``capacity`` keys and evicts the smallest one when a new key
+arrives.  A key that was evicted and comes back starts from the evicted
+count, recorded as its ``error`` bound.
+"""
+import heapq
+import threading
+
+
+class KeyStats:
+    __slots__ = ("packets", "bytes", "first_seen", "last_seen", "error")
+
+    def __init__(self, packets=0, error=0):
+        self.packets = packets
+        self.bytes = 0
+        self.first_seen = None
+        self.last_seen = None
+        self.error = error
+
+
+class DeviceStats(KeyStats):
+    """Per-IP counters plus a bounded set of the domains the device asked for."""
+    __slots__ = ("domains",)
+
+    def __init__(self, packets=0, error=0):
+        super().__init__(packets, error)
+        self.domains = set()
+
+
+class SpaceSaving:
+    """Space-Saving top-k table holding at most ``capacity`` KeyStats.
+
+    ``offer`` returns the stats object for a key, evicting the key with the
+    fewest packets when the table is full.  The newcomer inherits the
+    evicted count as its ``error`` bound, as in Metwally et al.
+    """
+
+    def __init__(self, capacity, factory=KeyStats):
+        self.capacity = capacity
+        self.factory = factory
+        self.table = {}
+        self._heap = []  # (packets when pushed, key); refreshed lazily
+        self.evictions = 0
+
+    def offer(self, key):
+        stats = self.table.get(key)
+        if stats is not None:
+            return stats
+        if len(self.table) < self.capacity:
+            stats = self.factory()
+        else:
+            floor = self._evict_min()
+            stats = self.factory(packets=floor, error=floor)
+        self.table[key] = stats
+        heapq.heappush(self._heap, (stats.packets, key))
+        return stats
+
+    def _evict_min(self):
+        heap = self._heap
+        while True:
+            packets, key = heapq.heappop(heap)
+            stats = self.table[key]
+            if stats.packets != packets:
+                heapq.heappush(heap, (stats.packets, key))
+                continue
+            del self.table[key]
+            self.evictions += 1
+            return packets
+
+    def top(self, n):
+        return heapq.nlargest(n, self.table.items(), key=lambda item: item[1].packets)
+
+    def clear(self):
+        self.table.clear()
+        self._heap.clear()
+        self.evictions = 0
+
+
+class TrafficAggregator:
+    def __init__(self, ip_capacity=10000, domain_capacity=10000, device_domains=256):
+        self.ips = SpaceSaving(ip_capacity, DeviceStats)
+        self.domains = SpaceSaving(domain_capacity)
+        self.device_domains = device_domains
+        self.total_packets = 0
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self._unique_ips = None
+
+    def add_many(self, records):
+        """Count ``(ts, ip, domain, proto, length)`` records under one lock hold."""
+        with self.lock:
+            for ts, ip, domain, _, length in records:
+                self._add(ts, ip, domain, length)
+
+    def _add(self, ts, ip, domain, length):
+        self.total_packets += 1
+        self.total_bytes += length
+
+        device = self.ips.offer(ip)
+        if device.first_seen is None:
+            device.first_seen = ts
+            self._unique_ips = None
+        device.last_seen = ts
+        device.packets += 1
+        device.bytes += length
+        if len(device.domains) < self.device_domains:
+            device.domains.add(domain)
+
+        stats = self.domains.offer(domain)
+        if stats.first_seen is None:
+            stats.first_seen = ts
+        stats.last_seen = ts
+        stats.packets += 1
+        stats.bytes += length
+
+    def unique_ips(self):
+        """Sorted list of tracked IPs, rebuilt only when the set changes."""
+        with self.lock:
+            if self._unique_ips is None:
+                self._unique_ips = sorted(self.ips.table)
+            return self._unique_ips
+
+    def top_ips(self, n):
+        with self.lock:
+            return self.ips.top(n)
+
+    def top_domains(self, n):
+        with self.lock:
+            return self.domains.top(n)
+
+    def clear(self):
+        with self.lock:
+            self.ips.clear()
+            self.domains.clear()
+            self.total_packets = 0
+            self.total_bytes = 0
+            self._unique_ips = None
+
+    def stats(self):
+        with self.lock:
+            return {
+                "total_packets": self.total_packets,
+                "total_bytes": self.total_bytes,
+                "tracked_ips": len(self.ips.table),
+                "tracked_domains": len(self.domains.table),
+                "ip_capacity": self.ips.capacity,
+                "domain_capacity": self.domains.capacity,
+                "ip_evictions": self.ips.evictions,
+                "domain_evictions": self.domains.evictions,
+            }
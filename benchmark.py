@@ -0,0 +1,215 @@
+"""Throughput and latency benchmarks for the DNS capture pipeline.
+
+Runs entirely offline on synthetic traffic (see replay.py), so it needs
+neither root nor a live interface:
+
+    python benchmark.py
+    python benchmark.py --packets 200000 --clients 10 --json results.json
+
+Scenarios:
+    decode       raw-bytes decoding of Ethernet DNS frames
+    decode_scapy scapy dissection of the same frames (--scapy; slow)
+    ingest       check_interfaces.record_dns per packet, then waiting for
+                 the ingest pipeline to drain (buffer, store queue,
+                 aggregation, broadcaster queue)
+    pipeline     decode + record_dns, i.e. what a capture worker and the
+                 web process do together
+    emit         broadcaster flush cost with --clients Socket.IO clients,
+                 plus the legacy one-emit-per-entry cost for comparison
+
+Each scenario reports packets/s, per-packet latency percentiles and the
+process's peak RSS after it ran.  The ingest scenarios also report the
+rate at which records were actually stored, including the drain, and how many records the pipeline
+sampled out or dropped because it was overloaded.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import dns_capture
+import replay
+
+
+def peak_rss_bytes():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+
+
+def percentiles(samples_ns, points=(50, 90, 99, 99.9)):
+    ordered = sorted(samples_ns)
+    if not ordered:
+        return {}
+    result = {}
+    for point in points:
+        index = min(len(ordered) - 1, int(len(ordered) * point / 100))
+        result[f"p{point:g}_us"] = ordered[index] / 1000
+    result["max_us"] = ordered[-1] / 1000
+    return result
+
+
+def timed(name, items, func):
+    """Call func(item) for every item, timing each call."""
+    perf = time.perf_counter_ns
+    samples = []
+    append = samples.append
+    start = perf()
+    for item in items:
+        t0 = perf()
+        func(item)
+        append(perf() - t0)
+    elapsed = (perf() - start) / 1e9
+    return {
+        "scenario": name,
+        "packets": len(samples),
+        "seconds": elapsed,
+        "packets_per_s": len(samples) / elapsed if elapsed else float("inf"),
+        **percentiles(samples),
+        "peak_rss_mb": peak_rss_bytes() / (1024 * 1024),
+    }
+
+
+def drained(result, pipeline, before):
+    """Wait for the ingest pipeline and add end-to-end figures to a timed() result."""
+    t0 = time.perf_counter()
+    pipeline.join()
+    drain = time.perf_counter() - t0
+    after = pipeline.stats()
+    result["drain_seconds"] = drain
+    for key in ("processed", "sampled_out", "dropped"):
+        result[key] = after[key] - before[key]
+    result["processed_per_s"] = result["processed"] / (result["seconds"] + drain)
+    return result
+
+
+def bench_emit(check_interfaces, clients, batch, rounds):
+    """Measure one broadcaster flush of `batch` entries to `clients` test clients."""
+    from ring_buffer import LogRecord
+    broadcaster = check_interfaces.broadcaster
+    socketio = check_interfaces.socketio
+    test_clients = [socketio.test_client(check_interfaces.app) for _ in range(clients)]
+    broadcaster.ack_timeout = 0  # test clients never ack
+    records = [LogRecord(i, time.time(), "10.0.0.1", "bench.example.com", 17, 80) for i in range(batch)]
+    perf = time.perf_counter_ns
+    samples = []
+    for _ in range(rounds):
+        broadcaster.publish_many(records)
+        t0 = perf()
+        broadcaster.flush()
+        samples.append(perf() - t0)
+        for client in test_clients:
+            client.get_received()
+    flush_seconds = sum(samples) / 1e9
+    entries = batch * rounds
+
+    legacy = []
+    entry = check_interfaces.record_to_entry(records[0])
+    for _ in range(min(entries, 2000)):
+        t0 = perf()
+        socketio.emit("new_log", entry)
+        legacy.append(perf() - t0)
+    for client in test_clients:
+        client.get_received()
+        client.disconnect()
+    return {
+        "scenario": "emit",
+        "clients": clients,
+        "batch": batch,
+        "batches": rounds,
+        "per_batch": percentiles(samples),
+        "per_entry_us": flush_seconds * 1e6 / entries,
+        "legacy_per_entry_us": sum(legacy) / len(legacy) / 1000 if legacy else None,
+        "peak_rss_mb": peak_rss_bytes() / (1024 * 1024),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--packets", type=int, default=100000)
+    parser.add_argument("--domains", type=int, default=5000)
+    parser.add_argument("--ips", type=int, default=500)
+    parser.add_argument("--clients", type=int, default=5, help="Socket.IO clients for the emit scenario")
+    parser.add_argument("--batch", type=int, default=500, help="entries per broadcaster flush")
+    parser.add_argument("--scapy", action="store_true", help="also benchmark the scapy decoder")
+    parser.add_argument("--log-level", default="ERROR",
+                        help="log level while benchmarking (DEBUG measures per-packet logging too)")
+    parser.add_argument("--json", metavar="FILE", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+    records = list(replay.synthetic_records(qps=10000, count=args.packets,
+                                            domains=args.domains, ips=args.ips))
+    frames = [replay.build_dns_frame(ip, domain, qid=i)
+              for i, (_, ip, domain, _, _) in enumerate(records)]
+    results = [timed("decode", frames, dns_capture.decode_frame)]
+    if args.scapy:
+        scapy = dns_capture._load_scapy()
+        packets = [scapy.Ether(frame) for frame in frames[:10000]]
+        results.append(timed("decode_scapy", packets, dns_capture.decode_scapy_packet))
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        cwd = os.getcwd()
+        os.chdir(store_dir)  # keep the default dns_store out of the working tree
+        try:
+            import check_interfaces
+        finally:
+            os.chdir(cwd)
+        logging.getLogger().setLevel(args.log_level)
+        check_interfaces.app.logger.setLevel(args.log_level)
+        check_interfaces.start_workers()
+        record_dns = check_interfaces.record_dns
+        pipeline = check_interfaces.pipeline
+
+        before = pipeline.stats()
+        results.append(drained(timed("ingest", records, lambda record: record_dns(*record)),
+                               pipeline, before))
+        now = time.time
+
+        def decode_and_record(frame):
+            decoded = dns_capture.decode_frame(frame)
+            if decoded is not None:
+                record_dns(now(), *decoded)
+
+        before = pipeline.stats()
+        results.append(drained(timed("pipeline", frames, decode_and_record), pipeline, before))
+        results.append(bench_emit(check_interfaces, args.clients, args.batch,
+                                  max(1, min(200, args.packets // args.batch))))
+        pipeline.stop()
+        check_interfaces.broadcaster.stop()
+        if check_interfaces.log_store is not None:
+            check_interfaces.log_store.close()
+
+    for result in results:
+        name = result["scenario"]
+        if name == "emit":
+            batch = result["per_batch"]
+            print(f"{name:>12}: {result['clients']} clients, batch {result['batch']}: "
+                  f"p50 {batch['p50_us']:.0f}us p99 {batch['p99_us']:.0f}us per flush, "
+                  f"{result['per_entry_us']:.2f}us/entry "
+                  f"(legacy new_log: {result['legacy_per_entry_us']:.2f}us/entry), "
+                  f"peak RSS {result['peak_rss_mb']:.0f} MB")
+        else:
+            print(f"{name:>12}: {result['packets_per_s']:>10,.0f} packets/s  "
+                  f"p50 {result['p50_us']:.1f}us  p99 {result['p99_us']:.1f}us  "
+                  f"p99.9 {result['p99.9_us']:.1f}us  max {result['max_us']:.0f}us  "
+                  f"peak RSS {result['peak_rss_mb']:.0f} MB")
+            if "drain_seconds" in result:
+                print(f"{'':>12}  processed {result['processed_per_s']:,.0f} packets/s "
+                      f"(drain {result['drain_seconds']:.2f}s)"
+                      f", {result['processed']} processed, "
+                      f"sampled out {result['sampled_out']}, dropped {result['dropped']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""Batched Socket.IO fan-out for captured DNS entries.
+
+Instead of one ``new_log`` emit per packet, entries are collected and
+flushed as a single ``new_logs`` event every ``flush_interval`` seconds or
+as soon as ``max_batch`` entries are pending, whichever comes first.
+
+Entries can be published in any form; if a ``serialize`` function is
+given they are converted to JSON-ready dicts on the flushing thread.
+
+Every connected client gets its own bounded buffer.  A client receives
+the next batch only after acknowledging the previous one (or after
+``ack_timeout``), so a slow browser accumulates entries in its buffer
+instead of in the websocket.  When that buffer is full the oldest entries
+are dropped and the next batch tells the client how many it missed:
+
+    {"entries": [...], "dropped": 0}
+
+If more than ``max_pending`` entries are waiting for the flush thread,
+new entries are not queued at all.  They are folded into a summary that
+is sent to every client as one ``logs_summary`` event per flush, holding
+the number of entries it stands for and the most frequent keys among them
+(``summary_key``, e.g. the domain):
+
+    {"count": 1234, "top": [["example.com", 321], ...]}
+
+A client can be put in a filter room with ``set_room``.  Given a ``route``
+function, which maps a list of published entries to the set of rooms each
+one belongs to, such a client only gets the entries routed to its room.
+Routing runs once per flush for all rooms, and only entries that some
+client will receive are serialized.  Legacy ``new_log`` events follow the
+same rooms: each one goes only to the clients whose room it was routed to.
+"""
+import logging
+import threading
+import time
+from collections import Counter, deque
+
+logger = logging.getLogger(__name__)
+
+
+class ClientBuffer:
+    __slots__ = ("sid", "pending", "in_flight_since", "dropped", "room")
+
+    def __init__(self, sid, size):
+        self.sid = sid
+        self.room = None  # None receives every entry
+        self.pending = deque(maxlen=size)
+        self.in_flight_since = None
+        self.dropped = 0
+
+
+class LogBroadcaster:
+    def __init__(self, socketio, flush_interval=0.05, max_batch=500,
+                 client_buffer=5000, ack_timeout=2.0, legacy_events=False, serialize=None,
+                 max_pending=None, summary_key=None, summary_top=10, emit_timer=None, route=None):
+        self.socketio = socketio
+        self.route = route
+        self.emit_timer = emit_timer  # emit_timer(event, seconds) after every emit
+        self.serialize = serialize
+        self.max_pending = max_pending
+        self.summary_key = summary_key
+        self.summary_top = summary_top
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.client_buffer = client_buffer
+        self.ack_timeout = ack_timeout
+        self.legacy_events = legacy_events
+
+        self._pending = []
+        self._summary_count = 0
+        self._summary_keys = Counter()
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.batches_sent = 0
+        self.entries_sent = 0
+        self.entries_dropped = 0
+        self.legacy_emits = 0
+        self.entries_summarized = 0
+        self.summaries_sent = 0
+
+    # ------------------------------------------------------------------
+    # Producer side
+    # ------------------------------------------------------------------
+    def publish_many(self, entries):
+        """Queue entries; returns False if they were only summarized."""
+        with self._lock:
+            if self.max_pending is not None and len(self._pending) + len(entries) > self.max_pending:
+                self._summary_count += len(entries)
+                if self.summary_key is not None:
+                    self._summary_keys.update(map(self.summary_key, entries))
+                return False
+            self._pending.extend(entries)
+            if len(self._pending) >= self.max_batch:
+                self._wakeup.notify()
+            return True
+
+    # ------------------------------------------------------------------
+    # Client registry
+    # ------------------------------------------------------------------
+    def add_client(self, sid):
+        with self._lock:
+            self._clients[sid] = ClientBuffer(sid, self.client_buffer)
+
+    def remove_client(self, sid):
+        with self._lock:
+            self._clients.pop(sid, None)
+
+    def set_room(self, sid, room):
+        """Deliver only entries routed to room to this client (None: everything)."""
+        with self._lock:
+            client = self._clients.get(sid)
+            if client is not None:
+                client.room = room
+
+    def _ack(self, sid, *args):
+        with self._lock:
+            client = self._clients.get(sid)
+            if client is not None:
+                client.in_flight_since = None
+                if client.pending:
+                    self._wakeup.notify()
+
+    # ------------------------------------------------------------------
+    # Flushing
+    # ------------------------------------------------------------------
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            self._wakeup.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        self.flush()
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._lock:
+                if len(self._pending) < self.max_batch:
+                    self._wakeup.wait(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing log batch: {e}")
+
+    def flush(self):
+        """Distribute pending entries to client buffers and send what clients can take."""
+        now = time.monotonic()
+        sends = []
+        with self._lock:
+            batch, self._pending = self._pending, []
+            summary_count, summary_keys = self._summary_count, self._summary_keys
+            if summary_count:
+                self._summary_count, self._summary_keys = 0, Counter()
+                self.entries_summarized += summary_count
+            rooms = {client.room for client in self._clients.values()}
+            legacy = {}  # room -> sids, for the per-entry new_log events
+            if self.legacy_events:
+                for client in self._clients.values():
+                    legacy.setdefault(client.room if self.route is not None else None, []).append(client.sid)
+        by_room = self._route(batch, rooms) if batch else {}
+        with self._lock:
+            for client in self._clients.values():
+                entries = by_room.get(client.room if self.route is not None else None)
+                if entries:
+                    overflow = len(client.pending) + len(entries) - self.client_buffer
+                    if overflow > 0:
+                        client.dropped += overflow
+                        self.entries_dropped += overflow
+                    client.pending.extend(entries)
+                if not client.pending:
+                    continue
+                if (client.in_flight_since is not None
+                        and now - client.in_flight_since < self.ack_timeout):
+                    continue
+                count = min(len(client.pending), self.max_batch)
+                entries = [client.pending.popleft() for _ in range(count)]
+                sends.append((client.sid, {"entries": entries, "dropped": client.dropped}))
+                client.dropped = 0
+                client.in_flight_since = now
+                self.batches_sent += 1
+                self.entries_sent += count
+
+        for room, sids in legacy.items():
+            entries = by_room.get(room, ())
+            for entry in entries:
+                self._emit("new_log", entry, to=sids)
+            self.legacy_emits += len(entries)
+        for sid, payload in sends:
+            self._emit("new_logs", payload, to=sid,
+                       callback=lambda *args, sid=sid: self._ack(sid, *args))
+        if summary_count and self._clients:
+            self._emit("logs_summary", {
+                "count": summary_count,
+                "top": summary_keys.most_common(self.summary_top),
+            })
+            self.summaries_sent += 1
+
+    def _route(self, batch, rooms):
+        """Serialized entries per room; the None room gets the whole batch."""
+        serialize = self.serialize or (lambda item: item)
+        by_room = {}
+        # Records become JSON-ready dicts here, off the capture thread
+        if None in rooms or (rooms and self.route is None):
+            serialized = by_room[None] = [serialize(item) for item in batch]
+        else:
+            serialized = [None] * len(batch)
+        rooms = rooms - {None}
+        if not rooms or self.route is None:
+            return by_room
+        for room in rooms:
+            by_room[room] = []
+        for index, matched in enumerate(self.route(batch)):
+            for room in matched:
+                entries = by_room.get(room)
+                if entries is not None and room is not None:
+                    entry = serialized[index]
+                    if entry is None:
+                        entry = serialized[index] = serialize(batch[index])
+                    entries.append(entry)
+        return by_room
+
+    def _emit(self, event, *args, **kwargs):
+        if self.emit_timer is None:
+            self.socketio.emit(event, *args, **kwargs)
+            return
+        start = time.perf_counter()
+        self.socketio.emit(event, *args, **kwargs)
+        self.emit_timer(event, time.perf_counter() - start)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clients": len(self._clients),
+                "pending": len(self._pending),
+                "max_pending": self.max_pending,
+                "buffered": sum(len(c.pending) for c in self._clients.values()),
+                "batches_sent": self.batches_sent,
+                "entries_sent": self.entries_sent,
+                "entries_dropped": self.entries_dropped,
+                "legacy_emits": self.legacy_emits,
+                "entries_summarized": self.entries_summarized,
+                "summaries_sent": self.summaries_sent,
+                "legacy_events": self.legacy_events,
+            }
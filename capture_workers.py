@@ -0,0 +1,396 @@
+"""Per-interface capture worker processes.
+
+Each interface is captured and decoded by its own process, so parsing
+runs outside the web process's GIL.  Workers pack decoded records into a
+compact binary form and ship them to the web process in batches over a
+pipe, never as pickled dicts:
+
+    batch  = "R" <uint32 record count> <uint64 dropped so far> record*
+    record = <float64 ts> <uint32 length> <uint8 proto> <uint8 ip len>
+             <uint16 domain len> <ip utf-8> <domain utf-8>
+
+With instrumentation on, a worker also sends a stats message about once
+a second, holding what changed since the previous one:
+
+    stats  = "S" <uint64 kernel packets> <uint64 kernel drops>
+             <float64 decode seconds sum> <uint64 decode bucket count>*
+
+If the web process falls behind, a worker keeps at most ``max_pending``
+bytes queued and counts what it has to drop.
+
+A supervisor thread restarts workers that exit without being asked to,
+backing off between attempts and giving up after ``max_restarts``
+consecutive quick failures.  A worker stops by itself once the web
+process is gone, so an orphan never keeps capturing or holds on to the
+descriptors it inherited (such as the server's listening socket).
+"""
+import logging
+import multiprocessing
+import os
+import signal
+import struct
+import sys
+import threading
+import time
+from multiprocessing.connection import wait
+
+from metrics import LATENCY_BUCKETS, Histogram
+
+logger = logging.getLogger(__name__)
+
+_BATCH = struct.Struct("<IQ")
+_RECORD = struct.Struct("<dIBBH")
+_STATS = struct.Struct(f"<QQd{len(LATENCY_BUCKETS) + 1}Q")
+RECORDS_MESSAGE = b"R"
+STATS_MESSAGE = b"S"
+STATS_INTERVAL = 1.0
+
+# A worker that ran this long before dying is not "failing quickly"
+HEALTHY_RUN_SECONDS = 60
+MAX_BACKOFF_SECONDS = 30
+
+
+# ============================================================================
+# WORKER PROCESS
+# ============================================================================
+def _worker_main(interface, engine, conn, stop_event, flush_interval, max_pending, instrument):
+    # The web process owns shutdown; don't inherit its signal handlers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    import dns_capture
+
+    # Polled rather than PR_SET_PDEATHSIG, which fires when the forking
+    # *thread* exits, and workers are forked from request threads
+    parent = os.getppid()
+    lock = threading.Lock()
+    state = {"pending": bytearray(), "count": 0, "dropped": 0}
+    pack = _RECORD.pack
+
+    def on_record(ts, ip, domain, proto, length):
+        ip_bytes = ip.encode("utf-8")
+        domain_bytes = domain.encode("utf-8")
+        with lock:
+            pending = state["pending"]
+            if len(pending) >= max_pending:
+                state["dropped"] += 1
+                return
+            pending += pack(ts, length, proto, len(ip_bytes), len(domain_bytes))
+            pending += ip_bytes
+            pending += domain_bytes
+            state["count"] += 1
+
+    decode = Histogram() if instrument else None
+    kernel = {"packets": 0, "drops": 0}
+    sent = {"counts": [0] * (len(LATENCY_BUCKETS) + 1), "sum": 0.0}
+
+    def on_kernel_stats(packets, drops):
+        with lock:
+            kernel["packets"] += packets
+            kernel["drops"] += drops
+
+    finished = threading.Event()
+
+    def flush():
+        with lock:
+            data, count = state["pending"], state["count"]
+            state["pending"], state["count"] = bytearray(), 0
+            dropped = state["dropped"]
+        if count:
+            conn.send_bytes(RECORDS_MESSAGE + _BATCH.pack(count, dropped) + data)
+
+    def send_stats():
+        counts, total, _ = decode.snapshot()
+        deltas = [after - before for after, before in zip(counts, sent["counts"])]
+        sent["counts"] = counts
+        with lock:
+            packets, drops = kernel["packets"], kernel["drops"]
+            kernel["packets"] = kernel["drops"] = 0
+        conn.send_bytes(STATS_MESSAGE + _STATS.pack(packets, drops, total - sent["sum"], *deltas))
+        sent["sum"] = total
+
+    def send_batches():
+        next_stats = time.monotonic() + STATS_INTERVAL
+        try:
+            while not finished.wait(flush_interval):
+                if os.getppid() != parent:
+                    logger.warning(f"Web process exited, stopping capture on {interface}")
+                    stop_event.set()
+                    return
+                flush()
+                if instrument and time.monotonic() >= next_stats:
+                    next_stats += STATS_INTERVAL
+                    send_stats()
+        except OSError:
+            stop_event.set()  # the web process went away
+
+    sender = threading.Thread(target=send_batches, daemon=True)
+    sender.start()
+    exitcode = 0
+    try:
+        if instrument:
+            dns_capture.capture(interface, on_record, stop_event, engine,
+                                decode_timer=decode.observe, on_kernel_stats=on_kernel_stats)
+        else:
+            dns_capture.capture(interface, on_record, stop_event, engine)
+    except Exception as e:
+        logger.error(f"Capture on {interface} failed: {e}")
+        exitcode = 1
+    finally:
+        finished.set()
+        sender.join(timeout=2)
+        try:
+            flush()
+            if instrument:
+                send_stats()
+        except OSError:
+            pass
+        conn.close()
+    sys.exit(exitcode)
+
+
+def iter_batch(data):
+    """Decode one worker batch (without its type byte) into ``(count, dropped, records)``."""
+    count, dropped = _BATCH.unpack_from(data, 0)
+    records = []
+    offset = _BATCH.size
+    unpack = _RECORD.unpack_from
+    size = _RECORD.size
+    for _ in range(count):
+        ts, length, proto, ip_len, domain_len = unpack(data, offset)
+        offset += size
+        ip = str(data[offset:offset + ip_len], "utf-8")
+        offset += ip_len
+        domain = str(data[offset:offset + domain_len], "utf-8")
+        offset += domain_len
+        records.append((ts, ip, domain, proto, length))
+    return count, dropped, records
+
+
+def parse_stats(data):
+    """Decode a stats message (without its type byte) into
+    ``(kernel_packets, kernel_drops, decode_sum, decode_bucket_counts)``."""
+    fields = _STATS.unpack(data)
+    return fields[0], fields[1], fields[2], list(fields[3:])
+
+
+# ============================================================================
+# SUPERVISOR (WEB PROCESS)
+# ============================================================================
+class Worker:
+    __slots__ = ("interface", "process", "conn", "stop_event", "started_at", "restarts",
+                 "failures", "records", "dropped", "wanted", "failed", "next_start", "exitcode",
+                 "kernel_packets", "kernel_drops", "process_dropped")
+
+    def __init__(self, interface):
+        self.interface = interface
+        self.process = None
+        self.conn = None
+        self.stop_event = None
+        self.started_at = None
+        self.restarts = 0
+        self.failures = 0
+        self.records = 0
+        self.dropped = 0  # across restarts
+        self.process_dropped = 0  # last cumulative count from the current process
+        self.wanted = True
+        self.failed = False
+        self.next_start = 0.0
+        self.exitcode = None
+        self.kernel_packets = 0
+        self.kernel_drops = 0
+
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def status(self):
+        return {
+            "interface": self.interface,
+            "alive": self.alive(),
+            "pid": self.process.pid if self.process is not None else None,
+            "started_at": self.started_at,
+            "restarts": self.restarts,
+            "records": self.records,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "last_exitcode": self.exitcode,
+            "kernel_packets": self.kernel_packets,
+            "kernel_drops": self.kernel_drops,
+        }
+
+
+class CaptureWorkerPool:
+    def __init__(self, on_records, engine="auto", start_method="fork",
+                 flush_interval=0.01, max_pending=8 * 1024 * 1024, max_restarts=5, on_decode_stats=None):
+        """``on_records(interface, records)`` is called from the collector thread.
+
+        If ``on_decode_stats(interface, counts, total)`` is given, workers time
+        every decode and read kernel drop counters, and the decode histogram
+        deltas they send are passed to it.
+        """
+        self.on_records = on_records
+        self.on_decode_stats = on_decode_stats
+        self.engine = engine
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_restarts = max_restarts
+        self._context = multiprocessing.get_context(start_method)
+        self._workers = {}
+        self._lock = threading.Lock()
+        self._collector = None
+        self._supervisor = None
+        self._running = threading.Event()
+
+    # ------------------------------------------------------------------
+    # Control
+    # ------------------------------------------------------------------
+    def start(self, interface):
+        """Start capturing on interface; a no-op if it is already running."""
+        with self._lock:
+            worker = self._workers.get(interface)
+            if worker is not None and worker.alive():
+                worker.wanted = True
+                return worker.status()
+            if worker is None:
+                worker = self._workers[interface] = Worker(interface)
+            worker.wanted = True
+            worker.failed = False
+            worker.failures = 0
+            self._spawn(worker)
+        self._ensure_threads()
+        return worker.status()
+
+    def _spawn(self, worker):
+        receiver, sender = self._context.Pipe(duplex=False)
+        worker.stop_event = self._context.Event()
+        worker.process = self._context.Process(
+            target=_worker_main,
+            args=(worker.interface, self.engine, sender, worker.stop_event,
+                  self.flush_interval, self.max_pending, self.on_decode_stats is not None),
+            name=f"capture-{worker.interface}",
+            daemon=True,
+        )
+        worker.process.start()
+        sender.close()  # the child holds the write end
+        worker.conn = receiver
+        worker.process_dropped = 0
+        worker.started_at = time.time()
+        logger.info(f"Started capture worker for {worker.interface} (pid {worker.process.pid})")
+
+    def stop(self, interface, timeout=3):
+        with self._lock:
+            worker = self._workers.get(interface)
+            if worker is None:
+                return None
+            worker.wanted = False
+        self._stop_process(worker, timeout)
+        return worker.status()
+
+    def stop_all(self, timeout=3):
+        with self._lock:
+            workers = list(self._workers.values())
+            for worker in workers:
+                worker.wanted = False
+        for worker in workers:
+            self._stop_process(worker, timeout)
+
+    def _stop_process(self, worker, timeout):
+        process = worker.process
+        if process is None:
+            return
+        worker.stop_event.set()
+        process.join(timeout)
+        if process.is_alive():
+            logger.warning(f"Capture worker for {worker.interface} did not stop, terminating")
+            process.terminate()
+            process.join(1)
+        worker.exitcode = process.exitcode
+
+    def interfaces(self):
+        with self._lock:
+            return [name for name, worker in self._workers.items() if worker.wanted]
+
+    def any_alive(self):
+        with self._lock:
+            return any(worker.alive() for worker in self._workers.values())
+
+    def status(self, interface=None):
+        with self._lock:
+            if interface is not None:
+                worker = self._workers.get(interface)
+                return worker.status() if worker is not None else None
+            return {name: worker.status() for name, worker in self._workers.items()}
+
+    # ------------------------------------------------------------------
+    # Background threads
+    # ------------------------------------------------------------------
+    def _ensure_threads(self):
+        self._running.set()
+        if self._collector is None or not self._collector.is_alive():
+            self._collector = threading.Thread(target=self._collect, daemon=True)
+            self._collector.start()
+        if self._supervisor is None or not self._supervisor.is_alive():
+            self._supervisor = threading.Thread(target=self._supervise, daemon=True)
+            self._supervisor.start()
+
+    def _collect(self):
+        while self._running.is_set():
+            with self._lock:
+                by_conn = {worker.conn: worker for worker in self._workers.values()
+                           if worker.conn is not None}
+            if not by_conn:
+                time.sleep(0.1)
+                continue
+            for conn in wait(list(by_conn), timeout=0.2):
+                worker = by_conn[conn]
+                try:
+                    data = conn.recv_bytes()
+                except (EOFError, OSError):
+                    with self._lock:
+                        if worker.conn is conn:
+                            worker.conn = None
+                    conn.close()
+                    continue
+                try:
+                    kind, body = data[:1], memoryview(data)[1:]
+                    if kind == STATS_MESSAGE:
+                        packets, drops, total, counts = parse_stats(body)
+                        worker.kernel_packets += packets
+                        worker.kernel_drops += drops
+                        self.on_decode_stats(worker.interface, counts, total)
+                        continue
+                    count, dropped, records = iter_batch(body)
+                    worker.records += count
+                    # A batch carries its process's running total, which restarts at 0
+                    worker.dropped += dropped - worker.process_dropped
+                    worker.process_dropped = dropped
+                    self.on_records(worker.interface, records)
+                except Exception as e:
+                    logger.error(f"Error handling batch from {worker.interface}: {e}")
+
+    def _supervise(self):
+        while self._running.is_set():
+            time.sleep(1)
+            now = time.time()
+            with self._lock:
+                for worker in self._workers.values():
+                    if not worker.wanted or worker.failed or worker.alive():
+                        continue
+                    if worker.process is not None and worker.next_start == 0.0:
+                        # Just noticed the exit: schedule a restart with backoff
+                        worker.exitcode = worker.process.exitcode
+                        if now - worker.started_at >= HEALTHY_RUN_SECONDS:
+                            worker.failures = 0
+                        worker.failures += 1
+                        if worker.failures > self.max_restarts:
+                            worker.failed = True
+                            logger.error(f"Capture worker for {worker.interface} keeps failing "
+                                         f"(exit code {worker.exitcode}); giving up")
+                            continue
+                        delay = min(2 ** (worker.failures - 1), MAX_BACKOFF_SECONDS)
+                        worker.next_start = now + delay
+                        logger.warning(f"Capture worker for {worker.interface} exited with code "
+                                       f"{worker.exitcode}; restarting in {delay}s")
+                    if worker.next_start and now >= worker.next_start:
+                        worker.next_start = 0.0
+                        worker.restarts += 1
+                        self._spawn(worker)
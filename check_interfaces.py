@@ -1,12 +1,23 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-from flask_socketio import SocketIO, emit
-from scapy.all import sniff, DNSQR, IP
+from flask_socketio import SocketIO, emit, join_room, leave_room
+from broadcaster import LogBroadcaster
+from log_store import LogStore
+from aggregation import TrafficAggregator
+from rollups import Rollups
+from ring_buffer import LogBuffer, LogRecord
+from capture_workers import CaptureWorkerPool
+from pipeline import IngestPipeline
+import export
+from subscriptions import SubscriptionRegistry, normalize_filter
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry, TimedLock
 import psutil
 import threading
 import time
 import logging
+import math
 import signal
+from itertools import count
 
 app = Flask(__name__)
 CORS(app)
@@ -17,23 +28,189 @@ logging.basicConfig(level=logging.DEBUG)
 # ============================================================================
 # IMPROVED MEMORY MANAGEMENT CONFIGURATION
 # ============================================================================
-from collections import deque
-from datetime import datetime, timedelta
+from datetime import datetime
 
 class Config:
-    MAX_LOGS_IN_MEMORY = 1000  # Consistent limit everywhere
-    CLEANUP_INTERVAL = 300     # Clean old logs every 5 minutes
+    MAX_LOGS_IN_MEMORY = 10000  # Consistent limit everywhere (~37 bytes per row + interned strings)
+    CLEANUP_INTERVAL = 10      # Evicting expired logs only pops the head, so run it often
+    MAX_LOGS_BYTES = 4 * 1024 * 1024  # Approximate memory budget for the log buffer
     MAX_LOG_AGE_HOURS = 24     # Keep logs for 24 hours max
-    MEMORY_WARNING_THRESHOLD = 800  # Warn when approaching limit
-
-# Use deque for better performance on append/pop operations
-logs = deque(maxlen=Config.MAX_LOGS_IN_MEMORY)  # Automatically limits size
-capturing = False
-selected_interface = None
-log_lock = threading.Lock()
-sniffer_thread = None
-stop_event = threading.Event()
+    MEMORY_WARNING_THRESHOLD = 8000  # Warn when approaching limit
+    UNPAGED_LOGS_LIMIT = 1000  # Newest entries returned by /logs without paging parameters
+    CAPTURE_ENGINE = "auto"    # "raw" (AF_PACKET), "scapy", or "auto" (raw, falling back to scapy)
+    CAPTURE_WORKER_START_METHOD = "fork"  # multiprocessing start method for capture workers
+    CAPTURE_WORKER_MAX_RESTARTS = 5       # Give up on a worker after this many quick crashes
+    BROADCAST_INTERVAL = 0.05  # Flush new_logs batches every 50 ms...
+    BROADCAST_MAX_BATCH = 500  # ...or as soon as this many entries are pending
+    CLIENT_BUFFER_SIZE = 5000  # Per-client backlog before old entries are dropped
+    BROADCAST_ACK_TIMEOUT = 2.0  # Seconds to wait for a client to ack a batch
+    LEGACY_NEW_LOG_EVENT = False  # Also emit one "new_log" event per entry
+    BROADCAST_MAX_PENDING = 20000  # Beyond this, entries are only sent as "logs_summary" counts
+    PIPELINE_QUEUE_SIZE = 50000   # Decoded records waiting for the store/aggregate stage
+    PIPELINE_BATCH = 2000         # Records handled per store/aggregate batch
+    PIPELINE_SAMPLE_AT = 0.5      # Start sampling when the queue is this full...
+    PIPELINE_SAMPLE_EVERY = 10    # ...admitting one record in this many
+    PIPELINE_SHED_QUEUE_SIZE = 200000  # Shed records queued to still be aggregated (~250 bytes each)
+    LOG_STORE_ENABLED = True   # Persist every entry to the on-disk segment store
+    LOG_STORE_DIR = "dns_store"
+    LOG_STORE_MAX_BYTES = 512 * 1024 * 1024   # Drop oldest segments above this size
+    LOG_STORE_SEGMENT_BYTES = 16 * 1024 * 1024  # Rotate segments at this size...
+    LOG_STORE_SEGMENT_SECONDS = 3600            # ...or after this long
+    LOG_STORE_MAX_QUEUED = 100000               # Rows waiting for the disk writer before dropping
+    AGGREGATION_CAPACITY = 10000  # Exact counters kept for this many IPs and domains each
+    ROLLUP_LEVELS = ((1, 3600), (60, 1440), (3600, 24 * 30))  # (bucket seconds, buckets kept): 1 h, 1 day, 30 days
+    ROLLUP_HLL_PRECISION = 9   # 512 registers per bucket, about 4.6% error on unique IPs
+    ROLLUP_TOP_DOMAINS = 10    # Top domains kept per bucket
+    TIMESERIES_MAX_POINTS = 2000  # Upper bound for /timeseries?points=
+    METRICS_ENABLED = True     # Latency histograms and /metrics; False removes all timing
+
+# Hot-path latency histograms (seconds).  With METRICS_ENABLED off these are
+# no-ops and nothing is timed.
+metrics = MetricsRegistry(enabled=Config.METRICS_ENABLED)
+lock_wait_seconds = metrics.histogram("dns_log_lock_wait_seconds", "Time spent waiting for the log buffer lock")
+store_append_seconds = metrics.histogram("dns_store_append_seconds",
+                                         "Time to append a batch to the log buffer and the store queue")
+aggregate_seconds = metrics.histogram("dns_aggregate_seconds",
+                                      "Time to add a batch to the traffic aggregates and rollups")
+cleanup_seconds = metrics.histogram("dns_cleanup_seconds", "Time taken by one expired-log eviction pass")
+logs_serialize_seconds = metrics.histogram("dns_logs_serialize_seconds",
+                                           "Time to build and serialize a /logs response")
+
+def time_emit(event, seconds):
+    metrics.histogram("dns_socket_emit_seconds", "Time taken by one Socket.IO emit",
+                      {"event": event}).observe(seconds)
+
+def time_decode(interface, counts, total):
+    metrics.histogram("dns_decode_seconds", "Time to decode one captured frame, measured in the capture worker",
+                      {"interface": interface}).merge(counts, total)
+
+stop_event = threading.Event()  # Stops in-process feeds such as replay.py
 cleanup_thread = None
+# Socket.IO clients may subscribe to a filter; clients with the same filter
+# share a room and the broadcaster matches each entry once per room
+subscriptions = SubscriptionRegistry()
+
+def route_records(records):
+    index = subscriptions.index
+    return [index.match(record.ip, record.domain) for record in records]
+
+broadcaster = LogBroadcaster(
+    socketio,
+    flush_interval=Config.BROADCAST_INTERVAL,
+    max_batch=Config.BROADCAST_MAX_BATCH,
+    client_buffer=Config.CLIENT_BUFFER_SIZE,
+    ack_timeout=Config.BROADCAST_ACK_TIMEOUT,
+    legacy_events=Config.LEGACY_NEW_LOG_EVENT,
+    serialize=lambda record: record_to_entry(record),
+    max_pending=Config.BROADCAST_MAX_PENDING,
+    summary_key=lambda record: record.domain,
+    emit_timer=time_emit if metrics.enabled else None,
+    route=route_records,
+)
+
+log_store = LogStore(
+    Config.LOG_STORE_DIR,
+    max_age_hours=Config.MAX_LOG_AGE_HOURS,
+    max_bytes=Config.LOG_STORE_MAX_BYTES,
+    segment_bytes=Config.LOG_STORE_SEGMENT_BYTES,
+    segment_seconds=Config.LOG_STORE_SEGMENT_SECONDS,
+    max_queued=Config.LOG_STORE_MAX_QUEUED,
+) if Config.LOG_STORE_ENABLED else None
+
+# Arrival-ordered buffer with count, byte and age limits.  Sequence ids
+# continue from the store so cursors survive a restart.
+logs = LogBuffer(
+    Config.MAX_LOGS_IN_MEMORY,
+    max_bytes=Config.MAX_LOGS_BYTES,
+    next_seq=log_store.next_seq if log_store is not None else 1,
+)
+if metrics.enabled:
+    logs.lock = TimedLock(logs.lock, lock_wait_seconds)
+log_lock = logs.lock
+
+aggregator = TrafficAggregator(
+    ip_capacity=Config.AGGREGATION_CAPACITY,
+    domain_capacity=Config.AGGREGATION_CAPACITY,
+)
+
+# Per-second/minute/hour counts, bytes, unique IPs and top domains for charts
+rollups = Rollups(
+    Config.ROLLUP_LEVELS,
+    precision=Config.ROLLUP_HLL_PRECISION,
+    top_k=Config.ROLLUP_TOP_DOMAINS,
+)
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def format_time(ts):
+    return time.strftime(TIME_FORMAT, time.localtime(ts))
+
+def parse_time_arg(name):
+    """Read a time query parameter given as epoch seconds or YYYY-MM-DD HH:MM:SS"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        return time.mktime(datetime.strptime(value, TIME_FORMAT).timetuple())
+    if not math.isfinite(seconds):
+        raise ValueError(f"{name} is not a finite time: {value}")
+    return seconds
+
+def parse_int_arg(name):
+    """Read an integer query parameter; raises ValueError instead of ignoring a malformed one"""
+    value = request.args.get(name)
+    return None if value is None else int(value)
+
+def protocol_name(proto):
+    return "UDP" if proto == 17 else str(proto)
+
+def record_to_entry(record):
+    return {"seq": record.seq, "ip": record.ip, "domain": record.domain,
+            "protocol": protocol_name(record.proto), "length": record.length,
+            "time": format_time(record.ts)}
+
+def store_row_to_entry(row):
+    seq, ts, ip, domain, protocol, length = row
+    return {"seq": seq, "ip": ip, "domain": domain, "protocol": protocol, "length": length,
+            "time": format_time(ts)}
+
+def use_store():
+    return log_store is not None and request.args.get("source") == "store"
+
+@socketio.on("connect")
+def handle_connect():
+    broadcaster.add_client(request.sid)
+
+@socketio.on("disconnect")
+def handle_disconnect():
+    subscriptions.unsubscribe(request.sid)
+    broadcaster.remove_client(request.sid)
+
+# Only receive matching entries from now on, e.g.
+#     socket.emit("subscribe", {"domains": ["example.com"], "exclude_ips": ["10.0.0.0/8"]}, reply)
+# The reply is {"room": ..., "filter": <normalized filter>} or {"error": ...}.
+@socketio.on("subscribe")
+def handle_subscribe(spec=None):
+    try:
+        spec = normalize_filter(spec)
+    except ValueError as e:
+        return {"error": str(e)}
+    room, previous = subscriptions.subscribe(request.sid, spec)
+    if previous is not None and previous != room:
+        leave_room(previous)
+    join_room(room)
+    broadcaster.set_room(request.sid, room)
+    return {"room": room, "filter": spec}
+
+@socketio.on("unsubscribe")
+def handle_unsubscribe(*args):
+    room = subscriptions.unsubscribe(request.sid)
+    if room is not None:
+        leave_room(room)
+    broadcaster.set_room(request.sid, None)
+    return {"room": None}
 
 # Get list of interfaces
 @app.route("/interfaces")
@@ -43,181 +220,308 @@ def interfaces():
     return jsonify(interfaces)
 
 # Get DNS logs
+# Without parameters this returns the newest UNPAGED_LOGS_LIMIT entries as a list.  With any of
+# since=<seq>, limit=, start=, end= it returns a page:
+#     {"entries": [...], "next": <seq to pass as since>, "has_more": bool}
 @app.route("/logs")
 def get_logs():
-    with log_lock:
-        # Convert deque to list for JSON serialization
-        return jsonify(list(logs))
+    try:
+        start, end = parse_time_arg("start"), parse_time_arg("end")
+    except ValueError:
+        return jsonify({"error": "Invalid start/end time"}), 400
+    try:
+        since, limit = parse_int_arg("since"), parse_int_arg("limit")
+    except ValueError:
+        return jsonify({"error": "since and limit must be integers"}), 400
+    if limit is not None:
+        if limit < 1:
+            return jsonify({"error": "limit must be at least 1"}), 400
+        limit = min(limit, Config.MAX_LOGS_IN_MEMORY)
+    paged = since is not None or limit is not None or start is not None or end is not None
+
+    if use_store():
+        if not paged:
+            rows = list(log_store.iter_rows(limit=Config.UNPAGED_LOGS_LIMIT, newest_first=True))
+            return jsonify([store_row_to_entry(row) for row in reversed(rows)])
+        page = limit if limit is not None else Config.MAX_LOGS_IN_MEMORY
+        if since is None:
+            rows = list(log_store.iter_rows(start, end, limit=page + 1, newest_first=True))
+            has_more = len(rows) > page
+            rows = rows[:page][::-1]
+            cursor = rows[-1][0] if rows else 0
+        else:
+            rows = list(log_store.iter_rows(start, end, limit=page + 1, since=since))
+            has_more = len(rows) > page
+            rows = rows[:page]
+            cursor = rows[-1][0] if rows else since
+        return jsonify({"entries": [store_row_to_entry(row) for row in rows],
+                        "next": cursor, "has_more": has_more})
+
+    etag = logs.version()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    # Only the tail after the cursor is copied under log_lock; entries are
+    # built and serialized after it is released
+    version, records = logs.snapshot(since, limit=None if paged else Config.UNPAGED_LOGS_LIMIT)
+    started = time.perf_counter()
+    if not paged:
+        response = jsonify([record_to_entry(record) for record in records])
+        response.set_etag(version)
+        logs_serialize_seconds.observe(time.perf_counter() - started)
+        return response
+
+    cursor = records[-1].seq if records else (since if since is not None else logs.next_seq - 1)
+    if start is not None or end is not None:
+        low = start if start is not None else float("-inf")
+        high = end if end is not None else float("inf")
+        records = [record for record in records if low <= record.ts <= high]
+    has_more = False
+    if limit is not None and len(records) > limit:
+        has_more = True
+        if since is None:
+            records = records[-limit:]
+        else:
+            records = records[:limit]
+            cursor = records[-1].seq
+    response = jsonify({"entries": [record_to_entry(record) for record in records],
+                        "next": cursor, "has_more": has_more})
+    response.set_etag(version)
+    logs_serialize_seconds.observe(time.perf_counter() - started)
+    return response
 
 # Show all unique IPs seen in DNS logs
 @app.route("/unique_ips")
 def unique_ips():
-    with log_lock:
-        unique = sorted({entry["ip"] for entry in logs if "ip" in entry and entry["ip"]})
-    return jsonify(unique)
+    return jsonify(aggregator.unique_ips())
 
-# Export all DNS logs as CSV
+# Export DNS logs as a stream.  Query parameters:
+#     format=csv|ndjson|columnar   gzip=1
+#     source=store                 the on-disk store instead of the buffer
+#     start=, end=                 epoch seconds or YYYY-MM-DD HH:MM:SS
+#     ip=<ip or CIDR>              repeatable
+#     domain=<suffix>              repeatable; matches the domain and its subdomains
+# Rows are read in chunks (store segments through their own read-only
+# connections), so capture is never blocked for the whole export.
 @app.route("/export")
 def export_logs():
-    import csv
-    from flask import Response
-    with log_lock:
-        export_logs = list(logs)
-    if not export_logs:
-        return Response('No data to export', mimetype='text/plain')
-    headers = export_logs[0].keys()
-    def generate():
-        import io
-        output = io.StringIO()
-        yield '\ufeff'  # UTF-8 BOM
-        writer = csv.DictWriter(output, fieldnames=headers)
-        writer.writeheader()
-        yield output.getvalue()
-        output.seek(0)
-        output.truncate(0)
-        for row in export_logs:
-            writer.writerow(row)
-            yield output.getvalue()
-            output.seek(0)
-            output.truncate(0)
-    return Response(generate(), mimetype='text/csv', headers={
-        'Content-Disposition': 'attachment; filename="dns_logs.csv"'
-    })
+    fmt = request.args.get("format", "csv")
+    if fmt not in export.FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(export.FORMATS)}"}), 400
+    compress = request.args.get("gzip", "").lower() in ("1", "true", "yes")
+    try:
+        start, end = parse_time_arg("start"), parse_time_arg("end")
+    except ValueError:
+        return jsonify({"error": "Invalid start/end time"}), 400
+    try:
+        networks = export.parse_networks(request.args.getlist("ip"))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid ip filter: {e}"}), 400
+    row_filter = export.RowFilter(start, end, networks, request.args.getlist("domain"))
+
+    if use_store():
+        # Rows written after the export started are left out
+        rows = log_store.iter_rows(start, end, until=log_store.next_seq - 1)
+    else:
+        if not len(logs):
+            return Response('No data to export', mimetype='text/plain')
+        rows = ((record.seq, record.ts, record.ip, record.domain, protocol_name(record.proto), record.length)
+                for record in logs.iter_records())
+    mimetype, extension = export.FORMATS[fmt]
+    filename = f"dns_logs.{extension}"
+    headers = {'Content-Disposition': f'attachment; filename="{filename}{".gz" if compress else ""}"'}
+    if compress:
+        mimetype = "application/gzip"
+    chunks = export.export_chunks(filter(row_filter, rows), fmt, compress, to_entry=store_row_to_entry)
+    return Response(chunks, mimetype=mimetype, headers=headers)
 
-# Stop traffic capture
+# Stop traffic capture on every interface
 @app.route("/stop", methods=["POST"])
 def stop_capture():
-    global capturing, sniffer_thread
-    
-    if capturing and sniffer_thread and sniffer_thread.is_alive():
-        stop_event.set()
-        capturing = False
+    stop_event.set()
+    if capture_pool.interfaces():
         app.logger.info("Stopping capture...")
-        sniffer_thread.join(timeout=3)
-        if sniffer_thread.is_alive():
-            app.logger.warning("Sniffer thread did not terminate gracefully")
-        else:
-            app.logger.info("Sniffer thread terminated successfully")
+        capture_pool.stop_all()
+        app.logger.info("Capture workers stopped")
     
     return jsonify({"status": "stopped", "memory_stats": get_memory_stats()})
 
-# Start traffic capture
+# Start traffic capture.  {"interface": "eth0"} or {"interfaces": ["eth0", "eth1"]}
+# replaces the set of captured interfaces; each one gets its own worker process.
 @app.route("/start", methods=["POST"])
 def start_capture():
-    global capturing, selected_interface, sniffer_thread, stop_event, cleanup_thread
-    data = request.get_json()
-    selected_interface = data.get("interface")
+    data = request.get_json() or {}
+    selected = data.get("interfaces") or ([data["interface"]] if data.get("interface") else [])
 
-    if not selected_interface:
+    if not selected:
         return jsonify({"error": "No interface selected"}), 400
+    if not isinstance(selected, list) or not all(isinstance(name, str) for name in selected):
+        return jsonify({"error": "interfaces must be a list of interface names"}), 400
+    unknown = [name for name in selected if name not in psutil.net_if_addrs()]
+    if unknown:
+        return jsonify({"error": f"Unknown interface: {', '.join(unknown)}"}), 400
     
-    if capturing:
-        stop_capture()
+    for interface in capture_pool.interfaces():
+        if interface not in selected:
+            capture_pool.stop(interface)
     
     stop_event.clear()
-    capturing = True
+    start_workers()
+    for interface in selected:
+        capture_pool.start(interface)
     
-    # Start sniffer thread
-    sniffer_thread = threading.Thread(target=capture_dns, args=(selected_interface,), daemon=True)
-    sniffer_thread.start()
+    app.logger.info(f"Started capture on interfaces: {', '.join(selected)}")
     
+    return jsonify({
+        "status": "started", 
+        "interfaces": capture_pool.status(),
+        "memory_stats": get_memory_stats()
+    })
+
+@app.route("/interfaces/<name>/start", methods=["POST"])
+def start_interface(name):
+    """Add one interface to the running capture"""
+    if name not in psutil.net_if_addrs():
+        return jsonify({"error": f"Unknown interface: {name}"}), 404
+    start_workers()
+    return jsonify(capture_pool.start(name))
+
+@app.route("/interfaces/<name>/stop", methods=["POST"])
+def stop_interface(name):
+    status = capture_pool.stop(name)
+    if status is None:
+        return jsonify({"error": f"Not capturing on {name}"}), 404
+    return jsonify(status)
+
+@app.route("/interfaces/<name>/status")
+def interface_status(name):
+    status = capture_pool.status(name)
+    if status is None:
+        return jsonify({"error": f"Not capturing on {name}"}), 404
+    return jsonify(status)
+
+def start_workers():
+    """Start the background threads record_dns relies on (idempotent)"""
+    global cleanup_thread
+    pipeline.start()
+    broadcaster.start()
+    if log_store is not None:
+        log_store.start()
+
     # Start cleanup thread if not already running
     if cleanup_thread is None or not cleanup_thread.is_alive():
         cleanup_thread = threading.Thread(target=cleanup_old_logs, daemon=True)
         cleanup_thread.start()
         app.logger.info("Started cleanup thread")
-    
-    app.logger.info(f"Started capture on interface: {selected_interface}")
-    
-    return jsonify({
-        "status": "started", 
-        "memory_stats": get_memory_stats()
-    })
 
 # ============================================================================
 # MEMORY MONITORING AND CLEANUP
 # ============================================================================
 def cleanup_old_logs():
-    """Background thread to clean up old logs periodically"""
+    """Background thread that evicts logs older than MAX_LOG_AGE_HOURS"""
     while True:
         try:
             time.sleep(Config.CLEANUP_INTERVAL)
-            if not logs:
-                continue
-            current_time = datetime.now()
-            cutoff_time = current_time - timedelta(hours=Config.MAX_LOG_AGE_HOURS)
-            with log_lock:
-                logs_list = list(logs)
-                cleaned_logs = []
-                for log_entry in logs_list:
-                    try:
-                        log_time = datetime.strptime(log_entry['time'], "%Y-%m-%d %H:%M:%S")
-                        if log_time >= cutoff_time:
-                            cleaned_logs.append(log_entry)
-                    except (ValueError, KeyError):
-                        cleaned_logs.append(log_entry)
-                logs.clear()
-                logs.extend(cleaned_logs[-Config.MAX_LOGS_IN_MEMORY:])
-                removed_count = len(logs_list) - len(cleaned_logs)
-                if removed_count > 0:
-                    app.logger.info(f"Cleaned up {removed_count} old log entries")
+            started = time.perf_counter()
+            removed_count = logs.evict_expired(Config.MAX_LOG_AGE_HOURS * 3600)
+            cleanup_seconds.observe(time.perf_counter() - started)
+            if removed_count > 0:
+                app.logger.info(f"Cleaned up {removed_count} old log entries")
         except Exception as e:
             app.logger.error(f"Error in cleanup thread: {e}")
 
 def get_memory_stats():
-    """Get current memory usage statistics"""
+    """Get current memory usage statistics, with measured bytes per column and string table"""
     return {
         "logs_count": len(logs),
         "max_logs": Config.MAX_LOGS_IN_MEMORY,
         "memory_usage_percent": (len(logs) / Config.MAX_LOGS_IN_MEMORY) * 100,
-        "cleanup_threshold": Config.MEMORY_WARNING_THRESHOLD
+        "cleanup_threshold": Config.MEMORY_WARNING_THRESHOLD,
+        "logs_bytes": logs.bytes,
+        "max_logs_bytes": Config.MAX_LOGS_BYTES,
+        "buffer": logs.memory_stats()
     }
 
 # ============================================================================
 # IMPROVED DNS CAPTURE WITH MEMORY MANAGEMENT
 # ============================================================================
-def capture_dns(interface):
-    def process_packet(packet):
-        if stop_event.is_set():
-            return True
-        try:
-            if packet.haslayer(DNSQR) and packet.haslayer(IP):
-                domain = packet[DNSQR].qname.decode("utf-8").rstrip(".")
-                ip = packet[IP].src
-                proto = packet.proto
-                proto_name = "UDP" if proto == 17 else str(proto)
-                length = len(packet)
-                timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-                entry = {
-                    "ip": ip,
-                    "domain": domain,
-                    "protocol": proto_name,
-                    "length": length,
-                    "time": timestamp
-                }
-                app.logger.debug(f"Captured DNS request: {domain} from {ip}")
-                with log_lock:
-                    logs.append(entry)
-                    current_size = len(logs)
-                    if current_size >= Config.MEMORY_WARNING_THRESHOLD:
-                        app.logger.warning(f"Memory usage high: {current_size}/{Config.MAX_LOGS_IN_MEMORY} logs")
-                socketio.emit("new_log", entry)
-                if len(logs) % 100 == 0:
-                    socketio.emit("memory_stats", get_memory_stats())
-        except Exception as e:
-            app.logger.error(f"Error processing packet: {e}")
-        return None
-    try:
-        app.logger.info(f"Starting capture on interface: {interface}")
-        sniff(filter="udp port 53", iface=interface, prn=process_packet, 
-              store=0, stop_filter=lambda p: stop_event.is_set())
-    except Exception as e:
-        import traceback
-        app.logger.error(f"Error starting capture: {e}\n{traceback.format_exc()}")
-    finally:
-        global capturing
-        capturing = False
-        app.logger.info("Capture stopped")
+# Stages: capture and decode run in the capture workers, then the ingest
+# pipeline (pipeline.py) hands batches to store_batch, which fills the
+# buffer, the store queue and the aggregates and passes entries to the
+# broadcaster to publish.  Nothing here logs per packet.
+memory_warning_logged = False
+
+def aggregate_batch(records):
+    """Count records in the traffic aggregates and rollups"""
+    aggregator.add_many(records)
+    rollups.add_many(records)
+
+def store_batch(records, shed=()):
+    """Store/aggregate stage: runs on the pipeline thread, one batch at a time.
+
+    ``shed`` holds the records the pipeline shed under load.  They skip the
+    buffer, store and broadcaster but are aggregated together with the
+    batch, so /top, /device-stats and /timeseries keep counting every record.
+    """
+    global memory_warning_logged
+    clock = time.perf_counter
+    if not records:
+        started = clock()
+        aggregate_batch(shed)
+        aggregate_seconds.observe(clock() - started)
+        return
+    started = clock()
+    first_seq = logs.extend(records)
+    log_records = [LogRecord(seq, *record) for seq, record in zip(count(first_seq), records)]
+    if log_store is not None:
+        log_store.append_many([(seq, ts, ip, domain, protocol_name(proto), length)
+                               for seq, ts, ip, domain, proto, length in log_records])
+    appended = clock()
+    store_append_seconds.observe(appended - started)
+    aggregate_batch(records + shed if shed else records)
+    aggregate_seconds.observe(clock() - appended)
+    broadcaster.publish_many(log_records)
+
+    current_size = len(logs)
+    if current_size >= Config.MEMORY_WARNING_THRESHOLD:
+        if not memory_warning_logged:
+            app.logger.warning(f"Memory usage high: {current_size}/{Config.MAX_LOGS_IN_MEMORY} logs")
+            memory_warning_logged = True
+    else:
+        memory_warning_logged = False
+    if (first_seq - 1) // 100 != log_records[-1].seq // 100:
+        stats = get_memory_stats()
+        started = clock()
+        socketio.emit("memory_stats", stats)
+        time_emit("memory_stats", clock() - started)
+
+pipeline = IngestPipeline(
+    store_batch,
+    capacity=Config.PIPELINE_QUEUE_SIZE,
+    max_batch=Config.PIPELINE_BATCH,
+    sample_at=Config.PIPELINE_SAMPLE_AT,
+    sample_every=Config.PIPELINE_SAMPLE_EVERY,
+    keep_shed=True,
+    shed_capacity=Config.PIPELINE_SHED_QUEUE_SIZE,
+)
+
+def record_dns(timestamp, ip, domain, proto, length):
+    """Queue one decoded DNS question for storing and broadcasting"""
+    pipeline.submit(((timestamp, ip, domain, proto, length),))
+
+def record_worker_batch(interface, records):
+    """Queue a batch decoded by a capture worker process"""
+    pipeline.submit(records)
+
+capture_pool = CaptureWorkerPool(
+    record_worker_batch,
+    engine=Config.CAPTURE_ENGINE,
+    start_method=Config.CAPTURE_WORKER_START_METHOD,
+    max_restarts=Config.CAPTURE_WORKER_MAX_RESTARTS,
+    on_decode_stats=time_decode if metrics.enabled else None,
+)
 
 # ============================================================================
 # ADDITIONAL ENDPOINTS FOR MEMORY MANAGEMENT
@@ -230,17 +534,19 @@ def memory_stats():
 @app.route("/clear_logs", methods=["POST"])
 def clear_logs():
     """New endpoint to manually clear all logs"""
-    with log_lock:
-        logs.clear()
-        app.logger.info("All logs cleared manually")
+    logs.clear()
+    app.logger.info("All logs cleared manually")
+    aggregator.clear()
+    rollups.clear()
     return jsonify({"status": "cleared", "logs_count": 0})
 
 # Graceful shutdown handler
 def shutdown_server(signal, frame):
     app.logger.info("Shutting down server...")
-    global capturing
-    if capturing:
-        stop_capture()
+    capture_pool.stop_all()
+    pipeline.stop()
+    if log_store is not None:
+        log_store.close()
     time.sleep(1)
     exit(0)
 
@@ -248,12 +554,104 @@ def shutdown_server(signal, frame):
 signal.signal(signal.SIGINT, shutdown_server)
 signal.signal(signal.SIGTERM, shutdown_server)
 
+@app.route("/store_stats")
+def store_stats():
+    """Segment count, size on disk and write counters of the log store"""
+    if log_store is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(log_store.stats(), enabled=True))
+
+@app.route("/broadcast_stats")
+def broadcast_stats():
+    """Batches sent and entries dropped by the Socket.IO broadcaster"""
+    return jsonify(dict(broadcaster.stats(), subscriptions=subscriptions.stats()))
+
+@app.route("/pipeline_stats")
+def pipeline_stats():
+    """Queue depth and shed/drop counts for every ingest stage"""
+    store = log_store.stats() if log_store is not None else None
+    publish = broadcaster.stats()
+    return jsonify({
+        "capture": {name: {"alive": worker["alive"], "records": worker["records"],
+                           "dropped": worker["dropped"]}
+                    for name, worker in capture_pool.status().items()},
+        "ingest": pipeline.stats(),
+        "store": {"depth": store["queued"], "capacity": store["max_queued"],
+                  "dropped": store["rows_dropped"]} if store is not None else None,
+        "publish": {"depth": publish["pending"], "capacity": publish["max_pending"],
+                    "summarized": publish["entries_summarized"],
+                    "client_dropped": publish["entries_dropped"]},
+    })
+
+# ============================================================================
+# PROMETHEUS METRICS
+# ============================================================================
+# Counters and gauges below are read from each component's stats() when
+# /metrics is scraped; only the histograms above are touched per batch.
+def per_interface(key):
+    return lambda: [({"interface": name}, worker[key]) for name, worker in capture_pool.status().items()]
+
+metrics.collect("dns_capture_records_total", "Records received from capture workers", "counter",
+                per_interface("records"))
+metrics.collect("dns_capture_worker_dropped_total", "Records a capture worker dropped because the web process fell behind",
+                "counter", per_interface("dropped"))
+metrics.collect("dns_kernel_packets_total", "Packets seen by the kernel socket filter (PACKET_STATISTICS, raw engine)",
+                "counter", per_interface("kernel_packets"))
+metrics.collect("dns_kernel_drops_total", "Packets dropped by the kernel before capture (PACKET_STATISTICS, raw engine)",
+                "counter", per_interface("kernel_drops"))
+metrics.collect("dns_capture_worker_restarts_total", "Capture worker restarts", "counter", per_interface("restarts"))
+metrics.collect("dns_capture_worker_up", "Whether the capture worker process is alive", "gauge",
+                lambda: [({"interface": name}, int(worker["alive"]))
+                         for name, worker in capture_pool.status().items()])
+
+def stage_depths():
+    store = log_store.stats() if log_store is not None else {"queued": 0}
+    return [({"stage": "ingest"}, pipeline.stats()["depth"]),
+            ({"stage": "store"}, store["queued"]),
+            ({"stage": "publish"}, broadcaster.stats()["pending"])]
+
+def stage_drops():
+    ingest = pipeline.stats()
+    publish = broadcaster.stats()
+    return [({"stage": "ingest", "reason": "sampled"}, ingest["sampled_out"]),
+            ({"stage": "ingest", "reason": "full"}, ingest["dropped"]),
+            ({"stage": "store", "reason": "full"}, log_store.stats()["rows_dropped"] if log_store is not None else 0),
+            ({"stage": "publish", "reason": "summarized"}, publish["entries_summarized"]),
+            ({"stage": "publish", "reason": "client_buffer"}, publish["entries_dropped"])]
+
+metrics.collect("dns_pipeline_queue_depth", "Records waiting in each ingest stage's queue", "gauge", stage_depths)
+metrics.collect("dns_pipeline_shed_total", "Records shed by each ingest stage, by reason", "counter", stage_drops)
+metrics.collect("dns_pipeline_processed_total", "Records handled by the store/aggregate stage", "counter",
+                lambda: pipeline.stats()["processed"])
+metrics.collect("dns_pipeline_untallied_total", "Shed records left out of the aggregates too (shed queue full)",
+                "counter", lambda: pipeline.stats()["untallied"])
+metrics.collect("dns_log_buffer_entries", "Entries in the in-memory log buffer", "gauge", lambda: len(logs))
+metrics.collect("dns_log_buffer_bytes", "Bytes used by the in-memory log buffer", "gauge", lambda: logs.bytes)
+metrics.collect("dns_log_buffer_evicted_total", "Entries evicted from the log buffer, by reason", "counter",
+                lambda: [({"reason": "expired"}, logs.evicted_expired), ({"reason": "full"}, logs.evicted_full)])
+metrics.collect("dns_socketio_clients", "Connected Socket.IO clients", "gauge",
+                lambda: broadcaster.stats()["clients"])
+metrics.collect("dns_subscription_rooms", "Distinct Socket.IO subscription filters", "gauge",
+                lambda: subscriptions.stats()["rooms"])
+metrics.collect("dns_broadcast_entries_sent_total", "Entries sent in new_logs batches", "counter",
+                lambda: broadcaster.stats()["entries_sent"])
+if log_store is not None:
+    metrics.collect("dns_store_rows_written_total", "Rows written to the on-disk store", "counter",
+                    lambda: log_store.stats()["rows_written"])
+    metrics.collect("dns_store_bytes", "Size of the on-disk store", "gauge", lambda: log_store.stats()["bytes"])
+
+@app.route("/metrics")
+def prometheus_metrics():
+    if not metrics.enabled:
+        return Response("Metrics are disabled\n", status=404, mimetype="text/plain")
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
 # Sniffer health check endpoint
 @app.route("/sniffer_status")
 def sniffer_status():
-    global sniffer_thread
     status = {
-        "alive": sniffer_thread.is_alive() if sniffer_thread else False,
+        "alive": capture_pool.any_alive(),
+        "interfaces": capture_pool.status(),
         "memory_stats": get_memory_stats()
     }
     return jsonify(status)
@@ -261,89 +659,103 @@ def sniffer_status():
 # ============================================================================
 # DEVICE TRAFFIC ANALYSIS
 # ============================================================================
-class DeviceStats:
-    def __init__(self):
-        self.total_bytes_sent = 0
-        self.total_bytes_received = 0
-        self.packets_sent = 0
-        self.packets_received = 0
-        self.first_seen = None
-        self.last_seen = None
-        self.connections = set()
-        self.protocols = {}
-
-# Глобальный словарь для хранения статистики по устройствам
-device_stats = {}
-device_stats_lock = threading.Lock()
-
-def update_device_stats(log):
-    with device_stats_lock:
-        device_ip = log['ip']
-        if device_ip not in device_stats:
-            device_stats[device_ip] = DeviceStats()
-            device_stats[device_ip].first_seen = log['time']
-        
-        stats = device_stats[device_ip]
-        stats.last_seen = log['time']
-        stats.total_bytes_received += int(log['length'])
-        stats.packets_received += 1
-        stats.connections.add(log['destination_ip'])
-        
-        # Определяем протокол по порту или другим признакам
-        protocol = determine_protocol(log)
-        if protocol:
-            stats.protocols[protocol] = stats.protocols.get(protocol, 0) + 1
-
-def determine_protocol(log):
-    # Простая логика определения протокола
-    # Можно расширить в зависимости от доступных данных
-    if 'dns' in log.get('type', '').lower():
-        return 'DNS'
-    elif 'http' in log.get('type', '').lower():
-        return 'HTTP'
-    elif 'https' in log.get('type', '').lower():
-        return 'HTTPS'
-    return 'Unknown'
+# Counters are updated by aggregate_batch as entries arrive (see aggregation.py),
+# so these endpoints never rescan the log buffer.  A DNS packet is counted
+# as sent by its source IP.
+def device_to_json(device):
+    return {
+        'total_bytes_sent': device.bytes,
+        'total_bytes_received': 0,
+        'packets_sent': device.packets,
+        'packets_received': 0,
+        'first_seen': format_time(device.first_seen),
+        'last_seen': format_time(device.last_seen),
+        'active_connections': len(device.domains),
+        'protocols': {'DNS': device.packets},
+        'count_error': device.error
+    }
 
 @app.route('/device-stats')
 def get_device_stats():
-    with device_stats_lock:
-        stats = {}
-        for ip, device in device_stats.items():
-            stats[ip] = {
-                'total_bytes_sent': device.total_bytes_sent,
-                'total_bytes_received': device.total_bytes_received,
-                'packets_sent': device.packets_sent,
-                'packets_received': device.packets_received,
-                'first_seen': device.first_seen,
-                'last_seen': device.last_seen,
-                'active_connections': len(device.connections),
-                'protocols': device.protocols
-            }
-        return jsonify(stats)
+    with aggregator.lock:
+        stats = {ip: device_to_json(device) for ip, device in aggregator.ips.table.items()}
+    return jsonify(stats)
 
 @app.route('/device-stats/<ip>')
 def get_device_stat(ip):
-    with device_stats_lock:
-        if ip not in device_stats:
+    with aggregator.lock:
+        device = aggregator.ips.table.get(ip)
+        if device is None:
             return jsonify({'error': 'Device not found'}), 404
-        
-        device = device_stats[ip]
-        return jsonify({
-            'total_bytes_sent': device.total_bytes_sent,
-            'total_bytes_received': device.total_bytes_received,
-            'packets_sent': device.packets_sent,
-            'packets_received': device.packets_received,
-            'first_seen': device.first_seen,
-            'last_seen': device.last_seen,
-            'active_connections': len(device.connections),
-            'protocols': device.protocols
-        })
-
-# Обновляем обработчик новых логов
-def handle_new_log(log):
-    update_device_stats(log)
-    # ... existing code ...
+        return jsonify(device_to_json(device))
+
+# Heaviest talkers and most queried domains
+@app.route('/top')
+def top():
+    n = min(request.args.get('n', 10, type=int), Config.AGGREGATION_CAPACITY)
+    kind = request.args.get('kind')
+    result = {}
+    if kind in (None, 'ips'):
+        result['ips'] = [
+            {'ip': ip, 'packets': s.packets, 'bytes': s.bytes, 'error': s.error,
+             'first_seen': format_time(s.first_seen), 'last_seen': format_time(s.last_seen)}
+            for ip, s in aggregator.top_ips(n)
+        ]
+    if kind in (None, 'domains'):
+        result['domains'] = [
+            {'domain': domain, 'packets': s.packets, 'bytes': s.bytes, 'error': s.error,
+             'first_seen': format_time(s.first_seen), 'last_seen': format_time(s.last_seen)}
+            for domain, s in aggregator.top_domains(n)
+        ]
+    if not result:
+        return jsonify({'error': "kind must be 'ips' or 'domains'"}), 400
+    result['totals'] = aggregator.stats()
+    return jsonify(result)
+
+# Time series for charts, from the rollups.  Query parameters:
+#     start=, end=     epoch seconds or YYYY-MM-DD HH:MM:SS; default: the last hour
+#     points=          at most this many points (default 300)
+#     resolution=      second|minute|hour; default: the finest that fits
+#     top=0            leave out the per-point top domains
+# Each point covers `bucket_seconds` seconds starting at `t`.
+ROLLUP_RESOLUTIONS = {"second": 1, "minute": 60, "hour": 3600}
+
+@app.route('/timeseries')
+def timeseries():
+    try:
+        end = parse_time_arg('end')
+        start = parse_time_arg('start')
+    except ValueError:
+        return jsonify({'error': 'Invalid start/end time'}), 400
+    end = time.time() if end is None else end
+    start = end - 3600 if start is None else start
+    if start > end:
+        return jsonify({'error': 'start is after end'}), 400
+    max_points = min(max(request.args.get('points', 300, type=int), 1), Config.TIMESERIES_MAX_POINTS)
+    level = None
+    resolution = request.args.get('resolution')
+    if resolution:
+        step = ROLLUP_RESOLUTIONS.get(resolution)
+        level = next((level for level in rollups.levels if level.step == step), None)
+        if level is None:
+            return jsonify({'error': f"resolution must be one of {', '.join(ROLLUP_RESOLUTIONS)}"}), 400
+    top = request.args.get('top', '1') != '0'
+
+    level, bucket_seconds, points = rollups.query(start, end, max_points, level=level, top=top)
+    for point in points:
+        point['time'] = format_time(point['t'])
+    return jsonify({
+        'resolution': level.step,
+        'bucket_seconds': bucket_seconds,
+        'start': start,
+        'end': end,
+        'points': points,
+    })
+
+@app.route('/rollup_stats')
+def rollup_stats():
+    """Retention and measured size of each rollup level"""
+    return jsonify(rollups.stats())
 
 # Run the application
 if __name__ == "__main__":
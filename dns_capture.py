@@ -0,0 +1,467 @@
+"""DNS capture engines.
+
+The raw engine reads frames straight from an AF_PACKET socket (or a pcap
+file) and decodes only the fields the analyzer needs: source IP, IP
+protocol, frame length and the first DNS question name.  Scapy is kept as
+a fallback engine and is only imported when that engine is actually used.
+
+Both engines report records through the same callback:
+
+    on_record(timestamp, ip, domain, proto, length)
+
+Live capture optionally reports how long each decode took through
+``decode_timer(seconds)``, and the raw engine reports the kernel's
+PACKET_STATISTICS through ``on_kernel_stats(packets, drops)`` about once a
+second.
+
+Run ``python dns_capture.py compare capture.pcap`` to check the two
+decoders against each other, or ``python dns_capture.py bench capture.pcap``
+to time them offline.
+"""
+import ctypes
+import ipaddress
+import logging
+import os
+import socket
+import struct
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+DNS_PORT = 53
+BPF_FILTER = "udp port 53"
+
+# pcap link-layer header types we know how to strip
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+
+ETH_P_ALL = 0x0003
+ETH_P_IP = 0x0800
+ETH_P_IPV6 = 0x86DD
+ETH_P_8021Q = 0x8100
+ETH_P_8021AD = 0x88A8
+
+ARPHRD_NONE = 65534
+ARPHRD_IPGRE = 778
+
+SO_ATTACH_FILTER = 26
+SOL_PACKET = 263
+PACKET_STATISTICS = 6
+_TPACKET_STATS = struct.Struct("II")  # struct tpacket_stats
+KERNEL_STATS_INTERVAL = 1.0
+RECV_BUFFER_SIZE = 65536
+SOCKET_TIMEOUT = 0.5
+
+# Classic BPF for "udp port 53" on Ethernet frames (tcpdump -dd output).
+_UDP_PORT_53_ETHERNET = (
+    (0x28, 0, 0, 0x0000000C),
+    (0x15, 0, 6, 0x000086DD),
+    (0x30, 0, 0, 0x00000014),
+    (0x15, 0, 15, 0x00000011),
+    (0x28, 0, 0, 0x00000036),
+    (0x15, 12, 0, 0x00000035),
+    (0x28, 0, 0, 0x00000038),
+    (0x15, 10, 11, 0x00000035),
+    (0x15, 0, 10, 0x00000800),
+    (0x30, 0, 0, 0x00000017),
+    (0x15, 0, 8, 0x00000011),
+    (0x28, 0, 0, 0x00000014),
+    (0x45, 6, 0, 0x00001FFF),
+    (0xB1, 0, 0, 0x0000000E),
+    (0x48, 0, 0, 0x0000000E),
+    (0x15, 2, 0, 0x00000035),
+    (0x48, 0, 0, 0x00000010),
+    (0x15, 0, 1, 0x00000035),
+    (0x06, 0, 0, 0x00040000),
+    (0x06, 0, 0, 0x00000000),
+)
+
+_unpack_u16 = struct.Struct("!H").unpack_from
+_unpack_udp_ports = struct.Struct("!HH").unpack_from
+_ipv4_ntoa = socket.inet_ntoa
+
+
+# ============================================================================
+# RAW DECODER
+# ============================================================================
+def _ipv6_ntoa(packed):
+    return str(ipaddress.IPv6Address(bytes(packed)))
+
+
+def _read_qname(buf, dns_start, offset, end):
+    """Decode the question name at offset of the DNS message at dns_start."""
+    labels = []
+    jumps = 0
+    while offset < end:
+        size = buf[offset]
+        if size == 0:
+            break
+        if size & 0xC0 == 0xC0:
+            # Compression pointers are unusual in questions but legal
+            if offset + 1 >= end or jumps > 16:
+                return None
+            offset = dns_start + ((size & 0x3F) << 8 | buf[offset + 1])
+            jumps += 1
+            continue
+        offset += 1
+        if offset + size > end:
+            return None
+        labels.append(bytes(buf[offset:offset + size]))
+        offset += size
+    else:
+        return None
+    try:
+        return b".".join(labels).decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+
+
+def decode_ip_packet(buf, offset=0, length=None):
+    """Decode a DNS question from an IPv4/IPv6 packet at buf[offset:].
+
+    Returns ``(src_ip, domain, proto, length)`` or ``None`` if the packet
+    is not a UDP DNS message with at least one question.
+    """
+    end = len(buf)
+    if length is None:
+        length = end
+    if offset >= end:
+        return None
+    version = buf[offset] >> 4
+    if version == 4:
+        ihl = (buf[offset] & 0x0F) * 4
+        if ihl < 20 or offset + ihl + 8 > end:
+            return None
+        proto = buf[offset + 9]
+        # Only the first fragment carries the UDP header
+        if proto != 17 or _unpack_u16(buf, offset + 6)[0] & 0x1FFF:
+            return None
+        src = _ipv4_ntoa(bytes(buf[offset + 12:offset + 16]))
+        udp = offset + ihl
+    elif version == 6:
+        if offset + 48 > end:
+            return None
+        proto = buf[offset + 6]
+        if proto != 17:
+            return None
+        src = _ipv6_ntoa(buf[offset + 8:offset + 24])
+        udp = offset + 40
+    else:
+        return None
+
+    sport, dport = _unpack_udp_ports(buf, udp)
+    if sport != DNS_PORT and dport != DNS_PORT:
+        return None
+    dns = udp + 8
+    # 12-byte header; qdcount lives at offset 4
+    if dns + 12 > end or _unpack_u16(buf, dns + 4)[0] == 0:
+        return None
+    domain = _read_qname(buf, dns, dns + 12, end)
+    if domain is None:
+        return None
+    return src, domain, proto, length
+
+
+def decode_frame(frame, linktype=LINKTYPE_ETHERNET, length=None):
+    """Strip the link-layer header and decode the DNS question, if any."""
+    if length is None:
+        length = len(frame)
+    if linktype == LINKTYPE_ETHERNET:
+        if len(frame) < 14:
+            return None
+        ethertype = _unpack_u16(frame, 12)[0]
+        offset = 14
+        while ethertype in (ETH_P_8021Q, ETH_P_8021AD) and offset + 4 <= len(frame):
+            ethertype = _unpack_u16(frame, offset + 2)[0]
+            offset += 4
+        if ethertype != ETH_P_IP and ethertype != ETH_P_IPV6:
+            return None
+        return decode_ip_packet(frame, offset, length)
+    if linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        return decode_ip_packet(frame, 0, length)
+    if linktype == LINKTYPE_LINUX_SLL:
+        if len(frame) < 16:
+            return None
+        ethertype = _unpack_u16(frame, 14)[0]
+        if ethertype != ETH_P_IP and ethertype != ETH_P_IPV6:
+            return None
+        return decode_ip_packet(frame, 16, length)
+    if linktype == LINKTYPE_NULL:
+        return decode_ip_packet(frame, 4, length)
+    return None
+
+
+# ============================================================================
+# SCAPY DECODER (FALLBACK)
+# ============================================================================
+_scapy = None
+
+
+def _load_scapy():
+    """Import scapy on first use; loading scapy.all takes seconds."""
+    global _scapy
+    if _scapy is None:
+        from scapy import all as scapy_all
+        _scapy = scapy_all
+    return _scapy
+
+
+def decode_scapy_packet(packet):
+    """Decode an already dissected scapy packet into the raw decoder's shape."""
+    scapy = _load_scapy()
+    if not packet.haslayer(scapy.DNSQR):
+        return None
+    if packet.haslayer(scapy.IP):
+        src = packet[scapy.IP].src
+        proto = packet[scapy.IP].proto
+    elif packet.haslayer(scapy.IPv6):
+        src = packet[scapy.IPv6].src
+        proto = packet[scapy.IPv6].nh
+    else:
+        return None
+    domain = packet[scapy.DNSQR].qname.decode("utf-8").rstrip(".")
+    return src, domain, proto, len(packet)
+
+
+# ============================================================================
+# PCAP FILES
+# ============================================================================
+def iter_pcap(path):
+    """Yield ``(timestamp, linktype, frame, orig_len)`` for a classic pcap file."""
+    with open(path, "rb") as f:
+        header = f.read(24)
+        if len(header) < 24:
+            return
+        magic = header[:4]
+        if magic in (b"\xd4\xc3\xb2\xa1", b"\x4d\x3c\xb2\xa1"):
+            endian = "<"
+        elif magic in (b"\xa1\xb2\xc3\xd4", b"\xa1\xb2\x3c\x4d"):
+            endian = ">"
+        else:
+            raise ValueError(f"{path}: not a classic pcap file (pcapng is not supported)")
+        nano = magic in (b"\x4d\x3c\xb2\xa1", b"\xa1\xb2\x3c\x4d")
+        divisor = 1e9 if nano else 1e6
+        linktype = struct.unpack(endian + "I", header[20:24])[0] & 0x0FFFFFFF
+        record = struct.Struct(endian + "IIII")
+        while True:
+            rec = f.read(16)
+            if len(rec) < 16:
+                return
+            ts_sec, ts_frac, incl_len, orig_len = record.unpack(rec)
+            frame = f.read(incl_len)
+            if len(frame) < incl_len:
+                return
+            yield ts_sec + ts_frac / divisor, linktype, frame, orig_len
+
+
+def read_pcap_raw(path, on_record):
+    """Feed every DNS question in a pcap file through the raw decoder."""
+    count = 0
+    for ts, linktype, frame, _ in iter_pcap(path):
+        decoded = decode_frame(frame, linktype)
+        if decoded is not None:
+            on_record(ts, *decoded)
+            count += 1
+    return count
+
+
+def read_pcap_scapy(path, on_record):
+    """Feed every DNS question in a pcap file through the scapy decoder."""
+    scapy = _load_scapy()
+    count = 0
+    for packet in scapy.PcapReader(path):
+        decoded = decode_scapy_packet(packet)
+        if decoded is not None:
+            on_record(float(packet.time), *decoded)
+            count += 1
+    return count
+
+
+# ============================================================================
+# LIVE CAPTURE
+# ============================================================================
+def _interface_linktype(interface):
+    """Map the interface's ARPHRD type to the frame layout AF_PACKET delivers."""
+    try:
+        with open(f"/sys/class/net/{interface}/type") as f:
+            hatype = int(f.read().strip())
+    except (OSError, ValueError):
+        return LINKTYPE_ETHERNET
+    if hatype in (ARPHRD_NONE, ARPHRD_IPGRE):
+        return LINKTYPE_RAW
+    return LINKTYPE_ETHERNET
+
+
+def _attach_filter(sock, program):
+    """Attach a classic BPF program so the kernel drops non-DNS traffic."""
+    insns = b"".join(struct.pack("HBBI", *insn) for insn in program)
+    buf = ctypes.create_string_buffer(insns)
+    fprog = struct.pack("HL", len(program), ctypes.addressof(buf))
+    # The kernel copies the program, so buf only has to outlive this call
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+
+def open_raw_socket(interface):
+    """Open an AF_PACKET socket bound to interface with the DNS filter attached."""
+    if not hasattr(socket, "AF_PACKET"):
+        raise OSError("AF_PACKET sockets are not available on this platform")
+    linktype = _interface_linktype(interface)
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+    try:
+        if linktype == LINKTYPE_ETHERNET:
+            _attach_filter(sock, _UDP_PORT_53_ETHERNET)
+        sock.bind((interface, 0))
+        sock.settimeout(SOCKET_TIMEOUT)
+    except Exception:
+        sock.close()
+        raise
+    return sock, linktype
+
+
+def read_packet_statistics(sock):
+    """Return ``(packets, drops)`` counted by the kernel since the last call.
+
+    ``packets`` includes the drops.  Reading the counters resets them.
+    """
+    return _TPACKET_STATS.unpack(sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, _TPACKET_STATS.size))
+
+
+def capture_raw(interface, on_record, stop_event, decode_timer=None, on_kernel_stats=None):
+    """Capture on interface with the raw AF_PACKET engine until stop_event is set."""
+    sock, linktype = open_raw_socket(interface)
+    buf = bytearray(RECV_BUFFER_SIZE)
+    view = memoryview(buf)
+    recv_into = sock.recv_into
+    now = time.time
+    clock = time.perf_counter
+    monotonic = time.monotonic
+    next_stats = monotonic() + KERNEL_STATS_INTERVAL
+    try:
+        logger.info(f"Raw capture on {interface} (linktype {linktype}, filter '{BPF_FILTER}')")
+        while not stop_event.is_set():
+            if on_kernel_stats is not None and monotonic() >= next_stats:
+                next_stats += KERNEL_STATS_INTERVAL
+                on_kernel_stats(*read_packet_statistics(sock))
+            try:
+                size = recv_into(buf)
+            except socket.timeout:
+                continue
+            except InterruptedError:
+                continue
+            if decode_timer is None:
+                decoded = decode_frame(view[:size], linktype, size)
+            else:
+                start = clock()
+                decoded = decode_frame(view[:size], linktype, size)
+                decode_timer(clock() - start)
+            if decoded is not None:
+                on_record(now(), *decoded)
+        if on_kernel_stats is not None:
+            on_kernel_stats(*read_packet_statistics(sock))
+    finally:
+        view.release()
+        sock.close()
+
+
+def capture_scapy(interface, on_record, stop_event, decode_timer=None, on_kernel_stats=None):
+    """Capture on interface through scapy's sniff(); slower, but portable.
+
+    Kernel statistics are not available through sniff(), so
+    ``on_kernel_stats`` is never called.
+    """
+    scapy = _load_scapy()
+    clock = time.perf_counter
+
+    def process_packet(packet):
+        if stop_event.is_set():
+            return
+        start = clock()
+        try:
+            decoded = decode_scapy_packet(packet)
+        except Exception as e:
+            logger.error(f"Error processing packet: {e}")
+            return
+        if decode_timer is not None:
+            decode_timer(clock() - start)
+        if decoded is not None:
+            on_record(float(packet.time), *decoded)
+
+    logger.info(f"Scapy capture on {interface} (filter '{BPF_FILTER}')")
+    scapy.sniff(filter=BPF_FILTER, iface=interface, prn=process_packet,
+                store=0, stop_filter=lambda p: stop_event.is_set())
+
+
+def capture(interface, on_record, stop_event, engine="auto", decode_timer=None, on_kernel_stats=None):
+    """Capture DNS questions on interface with the requested engine.
+
+    ``engine`` is ``"raw"``, ``"scapy"`` or ``"auto"``; ``auto`` uses the raw
+    engine and falls back to scapy if the AF_PACKET socket cannot be opened.
+    """
+    hooks = {"decode_timer": decode_timer, "on_kernel_stats": on_kernel_stats}
+    if engine == "scapy":
+        return capture_scapy(interface, on_record, stop_event, **hooks)
+    if engine == "raw":
+        return capture_raw(interface, on_record, stop_event, **hooks)
+    try:
+        sock, _ = open_raw_socket(interface)
+        sock.close()
+    except (OSError, AttributeError) as e:
+        logger.warning(f"Raw capture unavailable on {interface} ({e}), falling back to scapy")
+        return capture_scapy(interface, on_record, stop_event, **hooks)
+    return capture_raw(interface, on_record, stop_event, **hooks)
+
+
+# ============================================================================
+# OFFLINE COMPARISON AND BENCHMARK
+# ============================================================================
+def _collect(reader, path):
+    records = []
+    reader(path, lambda ts, *rest: records.append(rest))
+    return records
+
+
+def compare_pcap(path):
+    """Return (raw_records, scapy_records, mismatches) for a pcap file."""
+    raw = _collect(read_pcap_raw, path)
+    scapy_records = _collect(read_pcap_scapy, path)
+    mismatches = [(i, a, b) for i, (a, b) in enumerate(zip(raw, scapy_records)) if a != b]
+    return raw, scapy_records, mismatches
+
+
+def bench_pcap(path, repeat=3):
+    """Time both decoders over a pcap file; returns packets/s per engine."""
+    frames = list(iter_pcap(path))
+    results = {}
+    for name, run in (
+        ("raw", lambda: sum(decode_frame(f, lt) is not None for _, lt, f, _ in frames)),
+        ("scapy", lambda: read_pcap_scapy(path, lambda *a: None)),
+    ):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = len(frames) / best if best else float("inf")
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in ("compare", "bench"):
+        print(f"usage: {os.path.basename(sys.argv[0])} compare|bench FILE.pcap")
+        sys.exit(2)
+    command, pcap_path = sys.argv[1:]
+    if command == "compare":
+        raw, scapy_records, mismatches = compare_pcap(pcap_path)
+        print(f"raw: {len(raw)} records, scapy: {len(scapy_records)} records, "
+              f"mismatches: {len(mismatches)}")
+        for index, a, b in mismatches[:20]:
+            print(f"  #{index}: raw={a} scapy={b}")
+        sys.exit(1 if mismatches or len(raw) != len(scapy_records) else 0)
+    for name, rate in bench_pcap(pcap_path).items():
+        print(f"{name:>6}: {rate:,.0f} packets/s")
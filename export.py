@@ -0,0 +1,275 @@
+"""Streaming export of DNS log rows.
+
+Exports work on ``(seq, ts, ip, domain, protocol, length)`` rows, as
+yielded by ``LogStore.iter_rows`` and ``LogBuffer.iter_records``, and are
+produced as a generator of byte chunks of about ``chunk_rows`` rows each,
+so memory use does not depend on the size of the export.
+
+Formats:
+
+    csv       the /export CSV (UTF-8 with BOM)
+    ndjson    one JSON entry per line
+    columnar  blocks of column arrays, described below
+
+Every format can be gzip-compressed on the fly.
+
+The columnar format is a magic line followed by blocks.  Each block has
+its own string dictionaries, so neither writer nor reader keeps state
+between blocks; a block with zero rows ends the stream.  All integers are
+little-endian:
+
+    b"DNSCOL2\\n"
+    block = <uint32 rows> <uint32 ip strings> <uint32 domain strings>
+            (<uint16 length> <utf-8 bytes>)*   ip strings, then domain strings
+            int64[rows] seq  int64[rows] ts in microseconds  uint8[rows] proto
+            uint32[rows] length  uint32[rows] ip index  uint32[rows] domain index
+
+Within a block, seq and ts are stored as differences from the previous
+row (the first row's from zero), which makes them compress to almost
+nothing.
+
+Read it back with ``iter_columnar`` or ``python export.py dump FILE``.
+"""
+import csv
+import gzip
+import io
+import ipaddress
+import itertools
+import json
+import operator
+import struct
+import sys
+import zlib
+from array import array
+from functools import lru_cache
+
+COLUMNAR_MAGIC = b"DNSCOL2\n"
+_BLOCK = struct.Struct("<III")
+_STRING = struct.Struct("<H")
+
+CSV_HEADERS = ["seq", "ip", "domain", "protocol", "length", "time"]
+
+FORMATS = {
+    # name: (mimetype, file extension)
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "columnar": ("application/octet-stream", "dnscol"),
+}
+
+
+# ============================================================================
+# FILTERS
+# ============================================================================
+def parse_networks(values):
+    """Parse IPs and CIDR blocks; raises ValueError on a malformed one."""
+    return [ipaddress.ip_network(value.strip(), strict=False) for value in values if value.strip()]
+
+
+def normalize_domain(domain):
+    return domain.strip().rstrip(".").lower()
+
+
+class RowFilter:
+    """Time range, source network and domain suffix filter for export rows.
+
+    A row passes if its timestamp is within ``[start, end]``, its IP is in
+    any of ``networks`` and its domain equals or ends in any of
+    ``domains``; an empty criterion matches everything.
+    """
+
+    def __init__(self, start=None, end=None, networks=(), domains=()):
+        self.start = start
+        self.end = end
+        self.networks = list(networks)
+        suffixes = [normalize_domain(domain) for domain in domains if normalize_domain(domain)]
+        self.domains = frozenset(suffixes)
+        self.dotted = tuple("." + suffix for suffix in suffixes)
+        self._ip_matches = lru_cache(maxsize=65536)(self._ip_in_networks)
+
+    def _ip_in_networks(self, ip):
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        return any(address.version == network.version and address in network
+                   for network in self.networks)
+
+    def __call__(self, row):
+        _, ts, ip, domain, _, _ = row
+        if self.start is not None and ts < self.start:
+            return False
+        if self.end is not None and ts > self.end:
+            return False
+        if self.networks and not self._ip_matches(ip):
+            return False
+        if self.domains:
+            domain = domain.rstrip(".").lower()
+            if domain not in self.domains and not domain.endswith(self.dotted):
+                return False
+        return True
+
+
+# ============================================================================
+# WRITERS
+# ============================================================================
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def csv_chunks(rows, to_entry, chunk_rows=1000):
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=CSV_HEADERS)
+    writer.writeheader()
+    yield ("\ufeff" + output.getvalue()).encode("utf-8")  # UTF-8 BOM
+    for batch in _batches(rows, chunk_rows):
+        output.seek(0)
+        output.truncate(0)
+        writer.writerows(map(to_entry, batch))
+        yield output.getvalue().encode("utf-8")
+
+
+def ndjson_chunks(rows, to_entry, chunk_rows=1000):
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+    for batch in _batches(rows, chunk_rows):
+        yield ("\n".join(dumps(to_entry(row)) for row in batch) + "\n").encode("utf-8")
+
+
+def _proto_number(protocol):
+    if protocol == "UDP":
+        return 17
+    try:
+        return int(protocol) & 0xFF
+    except (TypeError, ValueError):
+        return 0
+
+
+def _le_bytes(column):
+    if sys.byteorder != "little":
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def _string_table(values):
+    """Return (index column, string count, encoded dictionary) for one block."""
+    ids = {}
+    index = array("I")
+    parts = []
+    for value in values:
+        position = ids.get(value)
+        if position is None:
+            position = ids[value] = len(ids)
+            encoded = value.encode("utf-8")
+            parts.append(_STRING.pack(len(encoded)) + encoded)
+        index.append(position)
+    return index, len(ids), b"".join(parts)
+
+
+def columnar_chunks(rows, chunk_rows=4096):
+    yield COLUMNAR_MAGIC
+    for batch in _batches(rows, chunk_rows):
+        ip_index, ip_count, ip_table = _string_table(row[2] for row in batch)
+        domain_index, domain_count, domain_table = _string_table(row[3] for row in batch)
+        seqs = [row[0] for row in batch]
+        micros = [round(row[1] * 1e6) for row in batch]
+        yield b"".join((
+            _BLOCK.pack(len(batch), ip_count, domain_count), ip_table, domain_table,
+            _le_bytes(array("q", map(operator.sub, seqs, [0] + seqs[:-1]))),
+            _le_bytes(array("q", map(operator.sub, micros, [0] + micros[:-1]))),
+            _le_bytes(array("B", (_proto_number(row[4]) for row in batch))),
+            _le_bytes(array("I", (row[5] for row in batch))),
+            _le_bytes(ip_index),
+            _le_bytes(domain_index),
+        ))
+    yield _BLOCK.pack(0, 0, 0)
+
+
+def gzip_chunks(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_chunks(rows, fmt="csv", compress=False, to_entry=None):
+    """Byte chunks of rows in ``fmt``; ``to_entry`` builds the CSV/NDJSON dicts."""
+    if fmt == "csv":
+        chunks = csv_chunks(rows, to_entry)
+    elif fmt == "ndjson":
+        chunks = ndjson_chunks(rows, to_entry)
+    elif fmt == "columnar":
+        chunks = columnar_chunks(rows)
+    else:
+        raise ValueError(f"Unknown export format: {fmt}")
+    return gzip_chunks(chunks) if compress else chunks
+
+
+# ============================================================================
+# COLUMNAR READER
+# ============================================================================
+def _read_exact(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError("Truncated columnar export")
+    return data
+
+
+def _read_column(stream, code, count):
+    column = array(code)
+    column.frombytes(_read_exact(stream, column.itemsize * count))
+    if sys.byteorder != "little":
+        column.byteswap()
+    return column
+
+
+def _read_strings(stream, count):
+    strings = []
+    for _ in range(count):
+        (length,) = _STRING.unpack(_read_exact(stream, _STRING.size))
+        strings.append(_read_exact(stream, length).decode("utf-8"))
+    return strings
+
+
+def iter_columnar(stream):
+    """Yield ``(seq, ts, ip, domain, proto, length)`` rows from a columnar export."""
+    if _read_exact(stream, len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+        raise ValueError("Not a columnar DNS export")
+    while True:
+        rows, ip_count, domain_count = _BLOCK.unpack(_read_exact(stream, _BLOCK.size))
+        if not rows:
+            return
+        ips = _read_strings(stream, ip_count)
+        domains = _read_strings(stream, domain_count)
+        seqs = itertools.accumulate(_read_column(stream, "q", rows))
+        stamps = (micros / 1e6 for micros in itertools.accumulate(_read_column(stream, "q", rows)))
+        protos = _read_column(stream, "B", rows)
+        lengths = _read_column(stream, "I", rows)
+        ip_index = _read_column(stream, "I", rows)
+        domain_index = _read_column(stream, "I", rows)
+        for seq, ts, proto, length, ip, domain in zip(seqs, stamps, protos, lengths, ip_index, domain_index):
+            yield seq, ts, ips[ip], domains[domain], proto, length
+
+
+def open_export(path):
+    """Open an export file, transparently decompressing gzip."""
+    with open(path, "rb") as f:
+        compressed = f.read(2) == b"\x1f\x8b"
+    return gzip.open(path, "rb") if compressed else open(path, "rb")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "dump":
+        sys.exit("usage: python export.py dump FILE.dnscol[.gz]")
+    with open_export(sys.argv[2]) as stream:
+        for seq, ts, ip, domain, proto, length in iter_columnar(stream):
+            print(json.dumps({"seq": seq, "ts": ts, "ip": ip, "domain": domain,
+                              "proto": proto, "length": length}))
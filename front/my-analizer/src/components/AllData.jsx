@@ -1,4 +1,4 @@
-import React, { useEffect, useState, useMemo, useCallback } from "react";
+import React, { useEffect, useState, useMemo, useCallback, useRef } from "react";
 import io from "socket.io-client";
 import { useLanguage } from "../contexts/LanguageContext";
 import {
@@ -26,7 +26,10 @@ ChartJS.register(
 
 export default function AllData({ selectedDomains }) {
   const { t, currentLang } = useLanguage();
+  // Unfiltered history from /logs; the live stream is filtered by the
+  // server subscription, so it is kept apart and only shown on top of it
   const [logs, setLogs] = useState([]);
+  const [liveLogs, setLiveLogs] = useState([]);
   const [currentPage, setCurrentPage] = useState(1);
   const [isCapturing, setIsCapturing] = useState(true);
   const logsPerPage = 20; // Количество записей на странице
@@ -34,12 +37,19 @@ export default function AllData({ selectedDomains }) {
   const [showAllData, setShowAllData] = useState(false);
   const [selectedIp, setSelectedIp] = useState(null); // State for selected IP
   const [notification, setNotification] = useState(null);
+  const socketRef = useRef(null);
+
+  // Live entries newer than the history, newest first
+  const shownLogs = useMemo(() => {
+    const newestSeq = logs.reduce((max, log) => Math.max(max, log.seq), 0);
+    return [...liveLogs.filter((log) => log.seq > newestSeq), ...logs].slice(0, 1000);
+  }, [logs, liveLogs]);
 
   // Filter logs to show all domains except those that are selected
   const filteredLogs = useMemo(() => {
     return showAllData
-      ? logs
-      : logs.filter((log) => {
+      ? shownLogs
+      : shownLogs.filter((log) => {
           // If no domains are selected, show all logs
           const anySelected = Object.values(selectedDomains).some(
             (value) => value
@@ -49,7 +59,7 @@ export default function AllData({ selectedDomains }) {
           // Otherwise, show logs for domains that are NOT selected
           return selectedDomains[log.domain] !== true;
         });
-  }, [logs, selectedDomains, showAllData]);
+  }, [shownLogs, selectedDomains, showAllData]);
 
   // Filter by selected IP if one is selected
   const ipFilteredLogs = useMemo(() => {
@@ -348,10 +358,13 @@ export default function AllData({ selectedDomains }) {
 
     // Подключаемся к WebSocket
     const socket = io("http://localhost:5000");
+    socketRef.current = socket;
 
-    // Слушаем новые логи
-    socket.on("new_log", (newLog) => {
-      setLogs((prevLogs) => [newLog, ...prevLogs.slice(0, 999)]); // Add new log at the beginning
+    // Слушаем пакеты новых логов; ack() lets the server send the next batch
+    socket.on("new_logs", (batch, ack) => {
+      const newLogs = [...batch.entries].reverse(); // Newest first
+      setLiveLogs((prevLogs) => [...newLogs, ...prevLogs].slice(0, 1000));
+      if (ack) ack();
     });
 
     // Set up automatic refresh interval
@@ -360,11 +373,40 @@ export default function AllData({ selectedDomains }) {
     }, 10000); // 10 seconds
 
     return () => {
+      socketRef.current = null;
       socket.disconnect();
       clearInterval(refreshInterval); // Clean up interval on component unmount
     };
   }, []);
 
+  // Let the server filter the live stream the same way the table does
+  useEffect(() => {
+    const socket = socketRef.current;
+    if (!socket) return;
+    const excluded = showAllData
+      ? []
+      : Object.keys(selectedDomains)
+          // Root queries have an empty name, which no pattern can express
+          .filter((domain) => domain && selectedDomains[domain])
+          .map((domain) => "=" + domain);
+    const subscribe = () => {
+      if (excluded.length === 0 && !selectedIp) {
+        socket.emit("unsubscribe");
+      } else {
+        socket.emit("subscribe", {
+          exclude_domains: excluded,
+          ips: selectedIp ? [selectedIp] : [],
+        });
+      }
+    };
+    subscribe();
+    // Entries the old filter held back are only in the unfiltered history
+    fetchLogs();
+    // Subscriptions are per connection, so renew them after a reconnect
+    socket.on("connect", subscribe);
+    return () => socket.off("connect", subscribe);
+  }, [selectedDomains, selectedIp, showAllData]);
+
   const fetchLogs = async () => {
     try {
       const res = await fetch("http://localhost:5000/logs");
@@ -373,7 +415,10 @@ export default function AllData({ selectedDomains }) {
       const sortedData = data.sort(
         (a, b) => new Date(b.time) - new Date(a.time)
       );
+      const newestSeq = sortedData.reduce((max, log) => Math.max(max, log.seq), 0);
       setLogs(sortedData);
+      // The history now covers these; keep only what arrived after it
+      setLiveLogs((prevLogs) => prevLogs.filter((log) => log.seq > newestSeq));
       setLoading(false);
     } catch (err) {
       console.error("Ошибка загрузки логов:", err);
@@ -464,28 +509,15 @@ export default function AllData({ selectedDomains }) {
   }, [currentDomains, t]);
 // exporting all scanned data
 function exportAllToCSV() {
-  // Use the logs you want to export (all, filtered, or shown on screen)
-  const dataToExport = logs; // or use ipFilteredLogs if you want only filtered
-
-  if (!dataToExport.length) {
+  if (!logs.length && !liveLogs.length) {
     alert("Нет данных для экспорта!");
     return;
   }
 
-  const csvHeaders = Object.keys(dataToExport[0]);
-  const csvRows = [
-    csvHeaders.join(","), // header row
-    ...dataToExport.map(row =>
-      csvHeaders.map(field => 
-        `"${(row[field] ?? '').toString().replace(/"/g, '""')}"`
-      ).join(",")
-    )
-  ];
-
-  const csvContent = csvRows.join("\n");
-  const blob = new Blob([csvContent], { type: "text/csv;charset=utf-8;" });
+  // The server streams every captured entry, unaffected by the live
+  // stream's subscription filter or the table's 1000-row window
   const link = document.createElement("a");
-  link.href = URL.createObjectURL(blob);
+  link.href = "http://localhost:5000/export?format=csv";
   link.setAttribute("download", "all_data.csv");
   document.body.appendChild(link);
   link.click();
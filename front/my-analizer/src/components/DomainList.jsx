@@ -18,19 +18,23 @@ export default function DomainList({ selectedDomains, allDomains, onSelectionCha
   useEffect(() => {
     const socket = io("http://localhost:5000");
     
-    socket.on("new_log", (newLog) => {
-      // Check if this is a new domain
-      if (!domains.includes(newLog.domain)) {
-        // Add the new domain to the list
-        const updatedDomains = [...domains, newLog.domain];
-        setDomains(updatedDomains);
-        
-        // Update selected state for the new domain
-        onSelectionChange({
-          ...selectedDomains,
-          [newLog.domain]: false
+    socket.on("new_logs", (batch, ack) => {
+      // Check for domains we have not seen yet
+      const newDomains = [
+        ...new Set(batch.entries.map((log) => log.domain)),
+      ].filter((domain) => !domains.includes(domain));
+      if (newDomains.length > 0) {
+        // Add the new domains to the list
+        setDomains([...domains, ...newDomains]);
+
+        // Update selected state for the new domains
+        const updatedSelected = { ...selectedDomains };
+        newDomains.forEach((domain) => {
+          updatedSelected[domain] = false;
         });
+        onSelectionChange(updatedSelected);
       }
+      if (ack) ack();
     });
 
     // Set up automatic refresh interval
@@ -0,0 +1,431 @@
+"""Persistent, segmented on-disk store for DNS log entries.
+
+Entries are appended to SQLite segment files (WAL mode) in a directory:
+
+    dns_store/segment_000000000001.db
+    dns_store/segment_000000052311.db
+    ...
+
+Each segment holds a contiguous range of sequence numbers and an index on
+the capture timestamp.  The newest segment is rotated once it exceeds
+``segment_bytes`` or ``segment_seconds``.  Retention drops whole sealed
+segments that are older than ``max_age_hours`` or that push the store
+over ``max_bytes``.
+
+Writes never happen on the caller's thread: ``append`` only assigns a
+sequence number and queues the row, and a background writer commits the
+queue in batches.
+
+Run ``python log_store.py import network_logs/*.json`` to load the old
+JSON snapshots into the store.
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = "segment_"
+SEGMENT_SUFFIX = ".db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS logs (
+    seq INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    ip TEXT,
+    domain TEXT,
+    protocol TEXT,
+    length INTEGER
+);
+CREATE INDEX IF NOT EXISTS logs_ts ON logs (ts);
+"""
+
+
+class Segment:
+    __slots__ = ("path", "first_seq", "last_seq", "first_ts", "last_ts", "created")
+
+    def __init__(self, path, first_seq, last_seq=None, first_ts=None, last_ts=None, created=None):
+        self.path = path
+        self.first_seq = first_seq
+        self.last_seq = last_seq
+        self.first_ts = first_ts
+        self.last_ts = last_ts
+        self.created = created if created is not None else time.time()
+
+    def size(self):
+        total = 0
+        for path in (self.path, self.path + "-wal"):
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def overlaps(self, start, end):
+        if self.first_ts is None:
+            return False
+        if start is not None and self.last_ts < start:
+            return False
+        if end is not None and self.first_ts > end:
+            return False
+        return True
+
+
+class LogStore:
+    def __init__(self, directory, max_age_hours=24, max_bytes=512 * 1024 * 1024,
+                 segment_bytes=16 * 1024 * 1024, segment_seconds=3600,
+                 batch_size=1000, flush_interval=0.5, retention_interval=60, max_queued=None):
+        self.directory = os.path.abspath(directory)
+        self.max_age_hours = max_age_hours
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention_interval = retention_interval
+        self.max_queued = max_queued
+
+        self._queue = queue.Queue()  # lists of rows
+        self._queued = 0
+        self._seq_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._segments_lock = threading.Lock()
+        self._segments = []
+        self._conn = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_retention = 0.0
+
+        self.rows_written = 0
+        self.batches_written = 0
+        self.segments_dropped = 0
+        self.rows_dropped = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._load_segments()
+        last = self._segments[-1].last_seq if self._segments else None
+        self._next_seq = (last or 0) + 1
+
+    @property
+    def next_seq(self):
+        return self._next_seq
+
+    # ------------------------------------------------------------------
+    # Segment bookkeeping
+    # ------------------------------------------------------------------
+    def _load_segments(self):
+        paths = sorted(glob.glob(os.path.join(self.directory, SEGMENT_PREFIX + "*" + SEGMENT_SUFFIX)))
+        for path in paths:
+            name = os.path.basename(path)[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]
+            try:
+                first_seq = int(name)
+                conn = sqlite3.connect(path)
+                try:
+                    conn.executescript(_SCHEMA)
+                    row = conn.execute("SELECT MAX(seq), MIN(ts), MAX(ts) FROM logs").fetchone()
+                finally:
+                    conn.close()
+            except (ValueError, sqlite3.Error) as e:
+                logger.error(f"Skipping unreadable log segment {path}: {e}")
+                continue
+            self._segments.append(Segment(path, first_seq, row[0], row[1], row[2],
+                                          created=os.path.getmtime(path)))
+
+    def _open_segment(self, first_seq):
+        path = os.path.join(self.directory, f"{SEGMENT_PREFIX}{first_seq:012d}{SEGMENT_SUFFIX}")
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        return conn, Segment(path, first_seq)
+
+    def _current_connection(self, first_seq):
+        """Return the writer connection, rotating to a new segment when needed."""
+        with self._segments_lock:
+            current = self._segments[-1] if self._segments else None
+        if current is not None and self._conn is None:
+            self._conn = sqlite3.connect(current.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        full = current is not None and (
+            current.size() >= self.segment_bytes
+            or time.time() - current.created >= self.segment_seconds
+        )
+        if current is None or full:
+            if self._conn is not None:
+                self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                self._conn.close()
+            self._conn, segment = self._open_segment(first_seq)
+            with self._segments_lock:
+                self._segments.append(segment)
+        return self._conn
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+    def append(self, ts, ip, domain, protocol, length, seq=None):
+        """Queue one entry for writing and return its sequence number.
+
+        Callers that number entries themselves pass ``seq``; otherwise the
+        store assigns the next one.
+        """
+        with self._seq_lock:
+            if seq is None:
+                seq = self._next_seq
+            self._next_seq = max(self._next_seq, seq + 1)
+            self._enqueue([(seq, ts, ip, domain, protocol, length)])
+        return seq
+
+    def append_many(self, rows):
+        """Queue already numbered ``(seq, ts, ip, domain, protocol, length)`` rows.
+
+        Returns False if the queue is over ``max_queued`` rows and the
+        rows were dropped instead.
+        """
+        if not rows:
+            return True
+        with self._seq_lock:
+            self._next_seq = max(self._next_seq, rows[-1][0] + 1)
+            return self._enqueue(rows)
+
+    def _enqueue(self, rows):
+        if self.max_queued is not None and self._queued + len(rows) > self.max_queued:
+            self.rows_dropped += len(rows)
+            return False
+        self._queued += len(rows)
+        self._queue.put(rows)
+        return True
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._drain(block=True)
+                if time.time() - self._last_retention >= self.retention_interval:
+                    self.enforce_retention()
+            except Exception as e:
+                logger.error(f"Error in log store writer: {e}")
+
+    def _drain(self, block=False):
+        rows = []
+        try:
+            if block:
+                rows.extend(self._queue.get(timeout=self.flush_interval))
+            while len(rows) < self.batch_size:
+                rows.extend(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        if rows:
+            with self._seq_lock:
+                self._queued -= len(rows)
+            with self._write_lock:
+                self._write(rows)
+        return len(rows)
+
+    def _write(self, rows):
+        conn = self._current_connection(rows[0][0])
+        with conn:
+            conn.executemany("INSERT INTO logs VALUES (?, ?, ?, ?, ?, ?)", rows)
+        timestamps = [row[1] for row in rows]
+        with self._segments_lock:
+            segment = self._segments[-1]
+            segment.last_seq = max(row[0] for row in rows)
+            low, high = min(timestamps), max(timestamps)
+            segment.first_ts = low if segment.first_ts is None else min(segment.first_ts, low)
+            segment.last_ts = high if segment.last_ts is None else max(segment.last_ts, high)
+        self.rows_written += len(rows)
+        self.batches_written += 1
+
+    def flush(self):
+        """Write everything queued so far (used by the importer)."""
+        while self._drain():
+            pass
+
+    # ------------------------------------------------------------------
+    # Retention
+    # ------------------------------------------------------------------
+    def enforce_retention(self, now=None):
+        """Drop sealed segments that are too old or over the byte budget."""
+        now = time.time() if now is None else now
+        self._last_retention = now
+        cutoff = now - self.max_age_hours * 3600
+        with self._segments_lock:
+            sealed = self._segments[:-1]
+            total = sum(segment.size() for segment in self._segments)
+        dropped = []
+        for segment in sealed:
+            expired = segment.last_ts is not None and segment.last_ts < cutoff
+            if not expired and total <= self.max_bytes:
+                break
+            total -= segment.size()
+            dropped.append(segment)
+        if not dropped:
+            return 0
+        with self._segments_lock:
+            self._segments = [s for s in self._segments if s not in dropped]
+        for segment in dropped:
+            for path in (segment.path, segment.path + "-wal", segment.path + "-shm"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        self.segments_dropped += len(dropped)
+        logger.info(f"Log store retention dropped {len(dropped)} segment(s)")
+        return len(dropped)
+
+    # ------------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------------
+    def iter_rows(self, start=None, end=None, limit=None, newest_first=False, since=None, until=None):
+        """Yield ``(seq, ts, ip, domain, protocol, length)`` rows in a time range.
+
+        Rows come in sequence order, or newest first if ``newest_first``.
+        ``since`` skips every row with a sequence number up to and including
+        it, ``until`` every row after it.
+        """
+        with self._segments_lock:
+            segments = [s for s in self._segments if s.overlaps(start, end)
+                        and (since is None or (s.last_seq or 0) > since)]
+        if newest_first:
+            segments.reverse()
+        clauses, params = [], []
+        if start is not None:
+            clauses.append("ts >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("ts <= ?")
+            params.append(end)
+        if since is not None:
+            clauses.append("seq > ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("seq <= ?")
+            params.append(until)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        order = " ORDER BY seq DESC" if newest_first else " ORDER BY seq"
+        remaining = limit
+        for segment in segments:
+            if remaining is not None and remaining <= 0:
+                return
+            sql = f"SELECT seq, ts, ip, domain, protocol, length FROM logs{where}{order}"
+            if remaining is not None:
+                sql += f" LIMIT {int(remaining)}"
+            try:
+                conn = sqlite3.connect(f"file:{segment.path}?mode=ro", uri=True)
+            except sqlite3.Error:
+                continue  # dropped by retention while we were reading
+            try:
+                for row in conn.execute(sql, params):
+                    yield row
+                    if remaining is not None:
+                        remaining -= 1
+            finally:
+                conn.close()
+
+    def stats(self):
+        with self._segments_lock:
+            segments = list(self._segments)
+        return {
+            "segments": len(segments),
+            "bytes": sum(segment.size() for segment in segments),
+            "max_bytes": self.max_bytes,
+            "first_seq": segments[0].first_seq if segments else None,
+            "last_seq": segments[-1].last_seq if segments else None,
+            "queued": self._queued,
+            "max_queued": self.max_queued,
+            "rows_dropped": self.rows_dropped,
+            "rows_written": self.rows_written,
+            "batches_written": self.batches_written,
+            "segments_dropped": self.segments_dropped,
+        }
+
+
+# ============================================================================
+# IMPORTER FOR network_logs/*.json SNAPSHOTS
+# ============================================================================
+def iter_snapshot_entries(path):
+    """Yield the entries of a snapshot's "logs" array, tolerating truncated files."""
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    decoder = json.JSONDecoder()
+    index = text.find('"logs"')
+    if index < 0:
+        return
+    index = text.find("[", index) + 1
+    while index > 0:
+        while index < len(text) and text[index] in " \t\r\n,":
+            index += 1
+        if index >= len(text) or text[index] == "]":
+            return
+        try:
+            entry, index = decoder.raw_decode(text, index)
+        except json.JSONDecodeError:
+            logger.warning(f"{path}: stopped at truncated entry (offset {index})")
+            return
+        if isinstance(entry, dict):
+            yield entry
+
+
+def import_snapshots(store, paths):
+    """Import snapshot files, skipping entries already seen in earlier snapshots.
+
+    Snapshots overlap, so an entry is only imported as many times as it
+    occurs in the snapshot that contains it most often.
+    """
+    seen = {}
+    imported = 0
+    for path in paths:
+        counts = {}
+        for entry in iter_snapshot_entries(path):
+            try:
+                ts = time.mktime(datetime.strptime(entry["time"], "%Y-%m-%d %H:%M:%S").timetuple())
+                key = (ts, entry.get("ip"), entry.get("domain"),
+                       entry.get("protocol"), int(entry.get("length") or 0))
+            except (KeyError, ValueError, TypeError):
+                continue
+            counts[key] = counts.get(key, 0) + 1
+            if counts[key] > seen.get(key, 0):
+                seen[key] = counts[key]
+                store.append(*key)
+                imported += 1
+        store.flush()
+        logger.info(f"Imported {path}")
+    return imported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DNS log store utilities")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    importer = subparsers.add_parser("import", help="import network_logs JSON snapshots")
+    importer.add_argument("paths", nargs="+")
+    importer.add_argument("--dir", default="dns_store", help="store directory")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    store = LogStore(args.dir)
+    try:
+        count = import_snapshots(store, args.paths)
+    finally:
+        store.close()
+    print(f"Imported {count} entries into {args.dir}")
@@ -0,0 +1,170 @@
+"""Low-overhead counters and latency histograms, rendered for Prometheus.
+
+Histograms are observed on the hot path: one bisect and three additions
+under a short lock.  Everything else is read from the components' own
+``stats()`` at scrape time by collector callbacks, so it costs nothing
+between scrapes.
+
+A registry created with ``enabled=False`` hands out ``NULL_HISTOGRAM``,
+whose ``observe`` does nothing, and renders nothing; callers that would
+do extra per-packet work (decode timing, lock wait timing) check
+``registry.enabled`` and skip it entirely.
+"""
+import bisect
+import threading
+import time
+
+# Seconds, from 1 microsecond to 2.5 seconds
+LATENCY_BUCKETS = (
+    1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+    1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count", "_lock")
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def merge(self, counts, total):
+        """Add bucket counts and a sum observed elsewhere (e.g. in a worker process)."""
+        with self._lock:
+            for index, value in enumerate(counts):
+                self.counts[index] += value
+            self.sum += total
+            self.count += sum(counts)
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+class NullHistogram:
+    __slots__ = ()
+
+    def observe(self, value):
+        pass
+
+    def merge(self, counts, total):
+        pass
+
+
+NULL_HISTOGRAM = NullHistogram()
+
+
+class TimedLock:
+    """Wraps a lock and records how long each acquisition waited."""
+    __slots__ = ("lock", "histogram")
+
+    def __init__(self, lock, histogram):
+        self.lock = lock
+        self.histogram = histogram
+
+    def acquire(self, blocking=True, timeout=-1):
+        start = time.perf_counter()
+        acquired = self.lock.acquire(blocking, timeout)
+        self.histogram.observe(time.perf_counter() - start)
+        return acquired
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float) and value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._histograms = {}  # name -> (help, bounds, {labels: Histogram})
+        self._collectors = []  # (name, help, type, func)
+        self._lock = threading.Lock()
+
+    def histogram(self, name, help, labels=None, bounds=LATENCY_BUCKETS):
+        """Return the histogram for name and labels, creating it on first use."""
+        if not self.enabled:
+            return NULL_HISTOGRAM
+        key = tuple(sorted(labels.items())) if labels else ()
+        family = self._histograms.get(name)
+        if family is None or key not in family[2]:
+            with self._lock:
+                family = self._histograms.setdefault(name, (help, bounds, {}))
+                family[2].setdefault(key, Histogram(family[1]))
+        return family[2][key]
+
+    def collect(self, name, help, type, func):
+        """Register a counter or gauge read at scrape time.
+
+        ``func()`` returns a number, or an iterable of ``(labels, value)``
+        pairs for a labelled family.
+        """
+        if self.enabled:
+            self._collectors.append((name, help, type, func))
+
+    def render(self):
+        """The registry in the Prometheus text exposition format."""
+        lines = []
+        for name, help, type, func in self._collectors:
+            try:
+                value = func()
+            except Exception as e:
+                lines.append(f"# {name} unavailable: {e}")
+                continue
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {type}")
+            if isinstance(value, (int, float)):
+                lines.append(f"{name} {_format_value(value)}")
+            else:
+                for labels, sample in value:
+                    lines.append(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(sample)}")
+
+        with self._lock:
+            families = [(name, help, bounds, list(series.items()))
+                        for name, (help, bounds, series) in self._histograms.items()]
+        for name, help, bounds, series in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in series:
+                counts, total, count = histogram.snapshot()
+                cumulative = 0
+                for bound, bucket in zip(bounds + (float("inf"),), counts):
+                    cumulative += bucket
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
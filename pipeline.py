@@ -0,0 +1,227 @@
+"""Staged ingest of decoded DNS records.
+
+    capture -> decode -> ingest queue -> store/aggregate -> publish
+
+Capture and decode run in the capture worker processes (or in an
+in-process feed such as replay.py), which ``submit`` lists of
+``(ts, ip, domain, proto, length)`` tuples.  Those lists wait in a queue
+bounded by record count.  One thread drains the queue and passes batches of
+up to ``max_batch`` records to ``handler``, which does the store/aggregate
+work and hands entries on to the publish stage (the broadcaster).
+
+When the handler cannot keep up, the pipeline sheds load deliberately,
+and counts everything it sheds:
+
+* once the queue holds ``sample_at`` of its capacity, only every
+  ``sample_every``-th record is admitted ("sampling"; ``sampled_out``)
+  until it has drained to half that level again
+* records that do not fit at all are refused ("full"; ``dropped``)
+
+With ``keep_shed``, shed records still travel through the queue, in
+submission order, and reach the handler next to the admitted ones as
+``handler(admitted, shed)``, so cheap counters (the traffic aggregates
+and rollups) keep seeing every record while only the expensive store and
+publish work is shed.  They are split out on the pipeline thread, not the
+submitting one.  At most ``shed_capacity`` of them wait in the queue;
+beyond that they are not counted anywhere (``untallied``).
+
+Mode changes are logged once per change, never per record.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class IngestPipeline:
+    def __init__(self, handler, capacity=50000, max_batch=2000, sample_at=0.5, sample_every=10,
+                 keep_shed=False, shed_capacity=None):
+        self.handler = handler
+        self.keep_shed = keep_shed
+        self.capacity = capacity
+        self.shed_capacity = capacity * sample_every if shed_capacity is None else shed_capacity
+        self.max_batch = max_batch
+        self.sample_threshold = int(capacity * sample_at)
+        self.sample_every = sample_every
+
+        self._queue = deque()
+        self._depth = 0
+        self._shed_depth = 0
+        self._busy = False
+        self._phase = 0  # keeps the sampling stride steady across submits
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.mode = "normal"
+        self.submitted = 0
+        self.accepted = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self.batches = 0
+        self.processed = 0
+        self.tallied = 0
+        self.untallied = 0
+        self.errors = 0
+        self.max_depth_seen = 0
+
+    # ------------------------------------------------------------------
+    # Producer side
+    # ------------------------------------------------------------------
+    def submit(self, records):
+        """Queue decoded records; returns how many were admitted."""
+        total = len(records)
+        submitted = records
+        sampled = refused = None
+        every = self.sample_every
+        with self._lock:
+            self.submitted += total
+            depth = self._depth
+            threshold = self.sample_threshold
+            if self.mode != "normal":
+                threshold //= 2  # hysteresis, so the mode doesn't flap
+            if depth >= threshold:
+                sampled = (-self._phase) % every
+                kept = records[sampled::every]
+                self._phase = (self._phase + total) % every
+                self.sampled_out += total - len(kept)
+                records = kept
+                mode = "sampling"
+            else:
+                mode = "normal"
+            room = self.capacity - depth
+            if len(records) > room:
+                self.dropped += len(records) - room
+                refused = records[room:]
+                records = records[:room]
+                mode = "full"
+            shed = None
+            if self.keep_shed and (sampled is not None or refused):
+                count = total - len(records)
+                if self._shed_depth + count <= self.shed_capacity:
+                    # Split out on the pipeline thread, see _shed_records
+                    shed = (count, submitted, sampled, every, refused)
+                    self._shed_depth += count
+                else:
+                    self.untallied += count
+            if records or shed:
+                self._queue.append((records, shed))
+                self._depth += len(records)
+                self.accepted += len(records)
+                self.max_depth_seen = max(self.max_depth_seen, self._depth)
+                self._ready.notify()
+            changed, self.mode = mode != self.mode, mode
+        if changed:
+            if mode == "normal":
+                logger.info("Ingest pipeline caught up, admitting every record again")
+            else:
+                logger.warning(f"Ingest pipeline overloaded ({depth}/{self.capacity} queued), "
+                               f"now {mode}")
+        return len(records)
+
+    @staticmethod
+    def _shed_records(shed, records):
+        """Append the records a submit shed to records, in submission order."""
+        _, submitted, sampled, every, refused = shed
+        if sampled is not None:
+            records.extend(record for index, record in enumerate(submitted) if index % every != sampled)
+        if refused:
+            records.extend(refused)
+
+    # ------------------------------------------------------------------
+    # Consumer side
+    # ------------------------------------------------------------------
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        """Process what is queued, then stop the thread."""
+        self._stop.set()
+        with self._lock:
+            self._ready.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def join(self, timeout=None):
+        """Wait until everything submitted so far has been handled."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._depth or self._shed_depth or self._busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._queue and not self._stop.is_set():
+                    self._ready.wait(0.5)
+                if not self._queue:
+                    return
+                batch = []
+                sheds = []
+                shed_count = 0
+                while (self._queue and len(batch) < self.max_batch
+                       and shed_count < self.max_batch * self.sample_every):
+                    records, shed = self._queue.popleft()
+                    batch.extend(records)
+                    if shed is not None:
+                        sheds.append(shed)
+                        shed_count += shed[0]
+                self._depth -= len(batch)
+                self._shed_depth -= shed_count
+                self._busy = True
+            try:
+                if self.keep_shed:
+                    shed_records = []
+                    for shed in sheds:
+                        self._shed_records(shed, shed_records)
+                    self.handler(batch, shed_records)
+                else:
+                    self.handler(batch)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Error handling batch of {len(batch)} records: {e}")
+            with self._lock:
+                self._busy = False
+                self.batches += 1
+                self.processed += len(batch)
+                self.tallied += shed_count
+                # Otherwise the mode would only be updated by the next submit
+                caught_up = self.mode != "normal" and self._depth < self.sample_threshold // 2
+                if caught_up:
+                    self.mode = "normal"
+                self._idle.notify_all()
+            if caught_up:
+                logger.info("Ingest pipeline caught up, admitting every record again")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "depth": self._depth,
+                "capacity": self.capacity,
+                "sample_threshold": self.sample_threshold,
+                "sample_every": self.sample_every,
+                "max_depth_seen": self.max_depth_seen,
+                "submitted": self.submitted,
+                "accepted": self.accepted,
+                "sampled_out": self.sampled_out,
+                "dropped": self.dropped,
+                "batches": self.batches,
+                "processed": self.processed,
+                "shed_depth": self._shed_depth,
+                "shed_capacity": self.shed_capacity,
+                "tallied": self.tallied,
+                "untallied": self.untallied,
+                "errors": self.errors,
+            }
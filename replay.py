@@ -0,0 +1,218 @@
+"""Offline replay of DNS traffic through the capture pipeline.
+
+Records from pcap files, ``network_logs/*.json`` snapshots or a synthetic
+generator are fed to ``check_interfaces.record_dns``, which queues them on
+the same ingest pipeline the capture workers feed, so the whole ingest
+path can be exercised without root or a live interface.  Replaying faster
+than the pipeline can store makes it shed load; the counts are printed at
+the end.
+
+    python replay.py pcap capture.pcap --speed 0          # as fast as possible
+    python replay.py json network_logs/*.json --speed 10  # 10x realtime
+    python replay.py synth --qps 5000 --count 100000 --serve
+    python replay.py synth --count 100000 --write synthetic.pcap
+
+With ``--serve`` the Flask/Socket.IO app runs while the replay feeds it,
+so dashboards can be pointed at replayed traffic.
+"""
+import argparse
+import bisect
+import itertools
+import random
+import socket
+import struct
+import threading
+import time
+from datetime import datetime
+
+import dns_capture
+
+# ============================================================================
+# RECORD SOURCES
+# ============================================================================
+# Every source yields (timestamp, ip, domain, proto, length) tuples, the
+# arguments of dns_capture's on_record callback.
+
+def pcap_records(paths, engine="raw"):
+    """Decode pcap files with the raw decoder (or scapy, for comparison)."""
+    for path in paths:
+        if engine == "scapy":
+            records = []
+            dns_capture.read_pcap_scapy(path, lambda *record: records.append(record))
+            yield from records
+            continue
+        for ts, linktype, frame, _ in dns_capture.iter_pcap(path):
+            decoded = dns_capture.decode_frame(frame, linktype)
+            if decoded is not None:
+                yield (ts, *decoded)
+
+
+def json_records(paths):
+    """Read entries from network_logs JSON snapshots, in file order."""
+    from log_store import iter_snapshot_entries
+    for path in paths:
+        for entry in iter_snapshot_entries(path):
+            try:
+                ts = time.mktime(datetime.strptime(entry["time"], "%Y-%m-%d %H:%M:%S").timetuple())
+                protocol = str(entry.get("protocol", "UDP"))
+                proto = 17 if protocol == "UDP" else int(protocol)
+                yield ts, entry["ip"], entry["domain"], proto, int(entry.get("length") or 0)
+            except (KeyError, ValueError, TypeError):
+                continue
+
+
+def synthetic_records(qps=1000.0, count=None, duration=None, domains=1000, ips=100,
+                      skew=1.1, start=None, seed=0):
+    """Generate DNS questions at a fixed rate with Zipf-distributed domains and IPs.
+
+    ``domains`` and ``ips`` set the cardinality; ``skew`` is the Zipf
+    exponent (0 gives a uniform mix).  Stops after ``count`` records or
+    ``duration`` seconds of traffic time, whichever comes first.
+    """
+    rng = random.Random(seed)
+    start = time.time() if start is None else start
+    domain_names = [f"host{i}.zone{i % 50}.example.com" for i in range(domains)]
+    ip_addrs = [f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}" for i in range(ips)]
+    domain_weights = list(itertools.accumulate(1.0 / (rank + 1) ** skew for rank in range(domains)))
+    ip_weights = list(itertools.accumulate(1.0 / (rank + 1) ** skew for rank in range(ips)))
+    limit = count
+    if duration is not None:
+        by_duration = int(duration * qps)
+        limit = by_duration if limit is None else min(limit, by_duration)
+    interval = 1.0 / qps
+    index = 0
+    uniform = rng.random
+    while limit is None or index < limit:
+        domain = domain_names[bisect.bisect(domain_weights, uniform() * domain_weights[-1])]
+        ip = ip_addrs[bisect.bisect(ip_weights, uniform() * ip_weights[-1])]
+        # Ethernet + IPv4 + UDP + DNS header + question
+        length = 14 + 20 + 8 + 12 + len(domain) + 2 + 4
+        yield start + index * interval, ip, domain, 17, length
+        index += 1
+
+
+# ============================================================================
+# SYNTHETIC FRAMES
+# ============================================================================
+def build_dns_frame(ip, domain, qid=0, sport=40000):
+    """Build an Ethernet/IPv4/UDP DNS A query from `ip` for `domain`."""
+    qname = b"".join(bytes([len(label)]) + label.encode("utf-8")
+                     for label in domain.split(".") if label) + b"\x00"
+    dns = struct.pack("!HHHHHH", qid & 0xFFFF, 0x0100, 1, 0, 0, 0) + qname + struct.pack("!HH", 1, 1)
+    udp = struct.pack("!HHHH", sport, dns_capture.DNS_PORT, 8 + len(dns), 0) + dns
+    ip_header = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(udp), qid & 0xFFFF, 0, 64, 17, 0,
+                            socket.inet_aton(ip), socket.inet_aton("192.0.2.53"))
+    ethernet = b"\x02\x00\x00\x00\x00\x02" + b"\x02\x00\x00\x00\x00\x01" + struct.pack("!H", dns_capture.ETH_P_IP)
+    return ethernet + ip_header + udp
+
+
+def write_pcap(path, records):
+    """Write records as Ethernet DNS query frames to a classic pcap file."""
+    written = 0
+    with open(path, "wb") as f:
+        f.write(struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, dns_capture.LINKTYPE_ETHERNET))
+        for index, (ts, ip, domain, _, _) in enumerate(records):
+            frame = build_dns_frame(ip, domain, qid=index)
+            seconds = int(ts)
+            f.write(struct.pack("<IIII", seconds, int((ts - seconds) * 1e6), len(frame), len(frame)))
+            f.write(frame)
+            written += 1
+    return written
+
+
+# ============================================================================
+# REPLAY
+# ============================================================================
+def replay(records, on_record, speed=0.0, rebase=False, stop_event=None):
+    """Feed records to on_record.
+
+    ``speed`` 0 replays as fast as possible; otherwise inter-arrival gaps
+    are divided by ``speed`` (1.0 is realtime).  With ``rebase`` the
+    timestamps are shifted so the replay appears to happen now.
+    Returns ``(count, elapsed_seconds)``.
+    """
+    count = 0
+    first_ts = None
+    wall_start = time.monotonic()
+    epoch_start = time.time()
+    for ts, ip, domain, proto, length in records:
+        if stop_event is not None and stop_event.is_set():
+            break
+        if first_ts is None:
+            first_ts = ts
+        offset = ts - first_ts
+        if speed > 0:
+            offset /= speed
+            delay = wall_start + offset - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        if rebase:
+            ts = epoch_start + offset
+        on_record(ts, ip, domain, proto, length)
+        count += 1
+    return count, time.monotonic() - wall_start
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Replay DNS traffic through the capture pipeline")
+    parser.add_argument("source", choices=("pcap", "json", "synth"))
+    parser.add_argument("paths", nargs="*", help="pcap or JSON snapshot files")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="0 = as fast as possible, 1 = realtime, N = N times realtime")
+    parser.add_argument("--rebase", action="store_true", help="shift timestamps to start now")
+    parser.add_argument("--engine", choices=("raw", "scapy"), default="raw", help="pcap decoder")
+    parser.add_argument("--qps", type=float, default=1000.0, help="synthetic queries per second")
+    parser.add_argument("--count", type=int, default=None, help="synthetic record count")
+    parser.add_argument("--duration", type=float, default=None, help="synthetic traffic seconds")
+    parser.add_argument("--domains", type=int, default=1000, help="synthetic domain cardinality")
+    parser.add_argument("--ips", type=int, default=100, help="synthetic IP cardinality")
+    parser.add_argument("--skew", type=float, default=1.1, help="synthetic Zipf exponent")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--write", metavar="PCAP", help="write the records to a pcap instead of replaying")
+    parser.add_argument("--serve", action="store_true", help="run the web app while replaying")
+    args = parser.parse_args()
+    if args.source != "synth" and not args.paths:
+        parser.error(f"{args.source} replay needs at least one file")
+    if args.source == "synth" and args.count is None and args.duration is None and not args.serve:
+        parser.error("synthetic replay needs --count or --duration unless --serve is given")
+    return args
+
+
+def main():
+    args = _parse_args()
+    if args.source == "pcap":
+        records = pcap_records(args.paths, engine=args.engine)
+    elif args.source == "json":
+        records = json_records(args.paths)
+    else:
+        records = synthetic_records(args.qps, count=args.count, duration=args.duration,
+                                    domains=args.domains, ips=args.ips, skew=args.skew, seed=args.seed)
+    if args.write:
+        print(f"Wrote {write_pcap(args.write, records)} frames to {args.write}")
+        return
+
+    import check_interfaces
+    check_interfaces.start_workers()
+
+    def run():
+        count, elapsed = replay(records, check_interfaces.record_dns, speed=args.speed,
+                                rebase=args.rebase, stop_event=check_interfaces.stop_event)
+        rate = count / elapsed if elapsed else float("inf")
+        print(f"Replayed {count} records in {elapsed:.2f}s ({rate:,.0f} records/s)")
+
+    if args.serve:
+        threading.Thread(target=run, daemon=True).start()
+        check_interfaces.socketio.run(check_interfaces.app, host="0.0.0.0", port=5000)
+    else:
+        run()
+        check_interfaces.pipeline.stop()
+        stats = check_interfaces.pipeline.stats()
+        print(f"Pipeline processed {stats['processed']}, sampled out {stats['sampled_out']}, "
+              f"dropped {stats['dropped']}")
+        check_interfaces.broadcaster.stop()
+        if check_interfaces.log_store is not None:
+            check_interfaces.log_store.close()
+
+
+if __name__ == "__main__":
+    main()
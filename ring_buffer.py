@@ -0,0 +1,304 @@
+"""In-memory log buffer ordered by arrival time.
+
+The buffer is a fixed-capacity ring stored column by column in ``array``
+objects (struct of arrays), so an entry costs ``ROW_BYTES`` plus its share
+of two dictionary tables instead of a dict of five Python strings:
+
+    seq     int64    sequence number
+    ts      float64  capture time, epoch seconds
+    mono    float64  arrival time, time.monotonic()
+    ip      uint32   id in the IP string table
+    domain  uint32   id in the domain string table
+    proto   uint8    IP protocol number
+    length  uint32   frame length
+
+IPs and domains are interned in reference-counted string tables; an id
+is recycled once the last row using it is evicted.
+
+Because arrival order is also monotonic-time order, age-based eviction
+only ever has to pop the head of the ring, and it does so in short
+bursts so capture never waits on a long scan.  The buffer is bounded both
+by entry count and by a byte budget over the used rows and the tables.
+
+Timestamps stay numeric and strings stay interned here; building JSON
+entries is the API's job.
+"""
+import sys
+import threading
+import time
+from array import array
+from collections import namedtuple
+
+LogRecord = namedtuple("LogRecord", "seq ts ip domain proto length")
+
+COLUMNS = (
+    ("seq", "q"),
+    ("ts", "d"),
+    ("mono", "d"),
+    ("ip", "I"),
+    ("domain", "I"),
+    ("proto", "B"),
+    ("length", "I"),
+)
+ROW_BYTES = sum(array(code).itemsize for _, code in COLUMNS)
+
+
+class StringTable:
+    """Reference-counted string interning: str <-> small integer id."""
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+        self.refs = array("I")
+        self.free = []
+        self.string_bytes = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def intern(self, value):
+        index = self.ids.get(value)
+        if index is None:
+            if self.free:
+                index = self.free.pop()
+                self.strings[index] = value
+                self.refs[index] = 0
+            else:
+                index = len(self.strings)
+                self.strings.append(value)
+                self.refs.append(0)
+            self.ids[value] = index
+            self.string_bytes += sys.getsizeof(value)
+        self.refs[index] += 1
+        return index
+
+    def release(self, index):
+        self.refs[index] -= 1
+        if self.refs[index] == 0:
+            value = self.strings[index]
+            del self.ids[value]
+            self.strings[index] = None
+            self.free.append(index)
+            self.string_bytes -= sys.getsizeof(value)
+
+    def clear(self):
+        self.ids.clear()
+        self.strings.clear()
+        self.refs = array("I")
+        self.free.clear()
+        self.string_bytes = 0
+
+    def nbytes(self):
+        """Measured bytes: the dict, the id->str list, refcounts and the strings."""
+        return (sys.getsizeof(self.ids) + sys.getsizeof(self.strings)
+                + self.refs.buffer_info()[1] * self.refs.itemsize
+                + sys.getsizeof(self.free) + self.string_bytes)
+
+
+class LogBuffer:
+    def __init__(self, max_entries, max_bytes=None, next_seq=1):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.generation = 0  # bumped on every change
+        self.started = time.time_ns()  # tells this run's buffer apart from earlier ones
+        self.next_seq = next_seq
+        self.evicted_expired = 0
+        self.evicted_full = 0
+        self.ips = StringTable()
+        self.domains = StringTable()
+        self._head = 0
+        self._count = 0
+        for name, code in COLUMNS:
+            setattr(self, "_" + name, array(code, bytes(array(code).itemsize * max_entries)))
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def bytes(self):
+        """Bytes in use: occupied rows plus both string tables."""
+        return self._count * ROW_BYTES + self.ips.nbytes() + self.domains.nbytes()
+
+    def _evict_head(self):
+        head = self._head
+        self.ips.release(self._ip[head])
+        self.domains.release(self._domain[head])
+        self._head = (head + 1) % self.max_entries
+        self._count -= 1
+
+    def _append_row(self, ts, ip, domain, proto, length, mono):
+        if self._count == self.max_entries:
+            self._evict_head()
+            self.evicted_full += 1
+        index = (self._head + self._count) % self.max_entries
+        seq = self.next_seq
+        self.next_seq += 1
+        self._seq[index] = seq
+        self._ts[index] = ts
+        self._mono[index] = mono
+        self._ip[index] = self.ips.intern(ip)
+        self._domain[index] = self.domains.intern(domain)
+        self._proto[index] = proto
+        self._length[index] = length
+        self._count += 1
+        return seq
+
+    def _enforce_bytes(self):
+        if self.max_bytes is not None:
+            while self._count > 1 and self.bytes > self.max_bytes:
+                self._evict_head()
+                self.evicted_full += 1
+
+    def extend(self, rows):
+        """Add ``(ts, ip, domain, proto, length)`` rows under one lock hold.
+
+        Returns the sequence number of the first row; the rest follow
+        consecutively.
+        """
+        mono = time.monotonic()
+        with self.lock:
+            first = self.next_seq
+            for ts, ip, domain, proto, length in rows:
+                self._append_row(ts, ip, domain, proto, length, mono)
+            self._enforce_bytes()
+            self.generation += 1
+        return first
+
+    def evict_expired(self, max_age, batch=1000):
+        """Pop rows older than max_age seconds; returns how many were removed.
+
+        The lock is released between batches of ``batch`` pops.
+        """
+        cutoff = time.monotonic() - max_age
+        removed = 0
+        while True:
+            with self.lock:
+                count = 0
+                while count < batch and self._count and self._mono[self._head] < cutoff:
+                    self._evict_head()
+                    count += 1
+                if count:
+                    self.generation += 1
+                    self.evicted_expired += count
+                more = count == batch
+            removed += count
+            if not more:
+                return removed
+
+    def _version(self):
+        """ETag of the current contents; call with the lock held.
+
+        The generation alone restarts at 0 with the process, so it is
+        combined with the head and next sequence numbers (which continue
+        from the store) and the buffer's creation time.
+        """
+        head = self._seq[self._head] if self._count else self.next_seq
+        return f"{self.started:x}-{head}-{self.next_seq}-{self.generation}"
+
+    def version(self):
+        with self.lock:
+            return self._version()
+
+    def _column(self, column, start, count):
+        """Copy `count` cells of a column starting `start` rows after the head."""
+        begin = (self._head + start) % self.max_entries
+        end = begin + count
+        if end <= self.max_entries:
+            return column[begin:end]
+        return column[begin:] + column[:end - self.max_entries]
+
+    def _copy_rows(self, start, count):
+        """Copy `count` rows starting `start` rows after the head; call with the lock held."""
+        seqs = self._column(self._seq, start, count)
+        stamps = self._column(self._ts, start, count)
+        ip_strings, domain_strings = self.ips.strings, self.domains.strings
+        ips = [ip_strings[i] for i in self._column(self._ip, start, count)]
+        domains = [domain_strings[i] for i in self._column(self._domain, start, count)]
+        protos = self._column(self._proto, start, count)
+        lengths = self._column(self._length, start, count)
+        return seqs, stamps, ips, domains, protos, lengths
+
+    def snapshot(self, since=None, limit=None):
+        """Return (version, LogRecords newer than `since`), copying only that tail.
+
+        With ``limit``, only the newest ``limit`` of those are copied.
+
+        Column slices are copied and string ids resolved under the lock;
+        the records themselves are assembled after it is released.
+        """
+        with self.lock:
+            count = self._count
+            if since is not None and count:
+                last = self._seq[(self._head + count - 1) % self.max_entries]
+                count = min(max(last - since, 0), count)
+            if limit is not None:
+                count = min(count, limit)
+            columns = self._copy_rows(self._count - count, count)
+            version = self._version()
+        return version, list(map(LogRecord, *columns))
+
+    def iter_records(self, chunk=1000):
+        """Yield the rows present now, holding the lock for `chunk` rows at a time.
+
+        Rows appended after the call are not included; rows evicted while
+        iterating are skipped.
+        """
+        with self.lock:
+            if not self._count:
+                return
+            since = self._seq[self._head] - 1
+            last = self.next_seq - 1
+        while since < last:
+            with self.lock:
+                if not self._count:
+                    return
+                first = self._seq[self._head]
+                start = max(since + 1 - first, 0)
+                count = min(chunk, last - max(since, first - 1), self._count - start)
+                if count <= 0:
+                    return
+                columns = self._copy_rows(start, count)
+            records = list(map(LogRecord, *columns))
+            yield from records
+            since = records[-1].seq
+
+    def clear(self):
+        with self.lock:
+            self._head = 0
+            self._count = 0
+            self.ips.clear()
+            self.domains.clear()
+            self.generation += 1
+
+    def memory_stats(self):
+        """Measured bytes per column and per string table."""
+        with self.lock:
+            columns = {name: getattr(self, "_" + name).buffer_info()[1] * array(code).itemsize
+                       for name, code in COLUMNS}
+            tables = {
+                "ip_table": {"entries": len(self.ips), "bytes": self.ips.nbytes()},
+                "domain_table": {"entries": len(self.domains), "bytes": self.domains.nbytes()},
+            }
+            return {
+                "rows": self._count,
+                "row_bytes": ROW_BYTES,
+                "rows_bytes": self._count * ROW_BYTES,
+                "columns_allocated_bytes": columns,
+                **tables,
+                "used_bytes": self._count * ROW_BYTES + tables["ip_table"]["bytes"]
+                + tables["domain_table"]["bytes"],
+                "allocated_bytes": sum(columns.values()) + tables["ip_table"]["bytes"]
+                + tables["domain_table"]["bytes"],
+            }
+
+    def stats(self):
+        with self.lock:
+            return {
+                "count": self._count,
+                "bytes": self.bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "evicted_expired": self.evicted_expired,
+                "evicted_full": self.evicted_full,
+            }
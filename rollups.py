@@ -0,0 +1,252 @@
+"""Multi-resolution time-series rollups of DNS traffic.
+
+Every level (per second, per minute, per hour by default) is a ring of
+``slots`` buckets of ``step`` seconds, stored in fixed-size arrays:
+
+    bucket   int64    which bucket number (ts // step) the slot holds
+    count    uint64   DNS questions
+    bytes    uint64   frame bytes
+    hll      uint8    HyperLogLog registers for unique source IPs,
+                      2**precision per slot, all in one bytearray
+    top      list     the slot's top domains, frozen when it closes
+
+A slot whose ``bucket`` is not the one asked for is stale and reads as
+empty, so old data expires by being overwritten and a level keeps
+``step * slots`` seconds of history before its newest bucket.
+
+Top domains of each level's open bucket are counted in a bounded
+Space-Saving table (see aggregation.py) and frozen to the ``top_k`` most
+frequent when the bucket closes.  Records older than the open bucket
+still update counts, bytes and unique IPs, but not top domains.
+
+Records are grouped by second before they touch the levels, so a batch
+costs one update per level per second it spans, plus one HyperLogLog
+hash per distinct IP in that second.
+
+``query`` picks the finest level that covers the requested range in at
+most ``max_points`` points, merging neighbouring buckets if even the
+coarsest one needs more, so a response has a bounded size whatever the
+range.
+"""
+import math
+import sys
+import threading
+from array import array
+from collections import Counter
+
+from aggregation import SpaceSaving
+
+_MASK64 = (1 << 64) - 1
+_INVERSE_POWERS = [2.0 ** -rank for rank in range(65)]
+
+
+# ============================================================================
+# HYPERLOGLOG
+# ============================================================================
+def hll_position(value, precision):
+    """Return (register index, rank) of value in a 2**precision register sketch."""
+    # str hashes are SipHash, salted per process; fine for in-memory sketches
+    h = hash(value) & _MASK64
+    width = 64 - precision
+    rest = h & ((1 << width) - 1)
+    return h >> width, width - rest.bit_length() + 1
+
+
+def hll_estimate(registers):
+    """Cardinality estimate from HyperLogLog registers, with small-range correction."""
+    m = len(registers)
+    zeros = registers.count(0)
+    if zeros == m:
+        return 0
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / sum(map(_INVERSE_POWERS.__getitem__, registers))
+    if raw <= 2.5 * m and zeros:
+        return round(m * math.log(m / zeros))
+    return round(raw)
+
+
+# ============================================================================
+# ROLLUP LEVELS
+# ============================================================================
+class RollupLevel:
+    def __init__(self, step, slots, precision=9, top_k=10, top_capacity=1000):
+        self.step = step
+        self.slots = slots
+        self.registers = 1 << precision
+        self.top_k = top_k
+        self.bucket = array("q", [-1]) * slots
+        self.count = array("Q", [0]) * slots
+        self.bytes = array("Q", [0]) * slots
+        self.hll = bytearray(slots * self.registers)
+        self.top = [()] * slots
+        self.open_bucket = None
+        self.open_top = SpaceSaving(top_capacity)
+
+    @property
+    def retention(self):
+        return self.step * self.slots
+
+    def covers(self, bucket):
+        """Whether bucket is recent enough to still be held."""
+        return self.open_bucket is not None and bucket > self.open_bucket - self.slots
+
+    def _slot(self, bucket):
+        """Slot for bucket, reset if it held an older bucket; None if bucket is too old."""
+        slot = bucket % self.slots
+        held = self.bucket[slot]
+        if held != bucket:
+            if held > bucket:
+                return None
+            self.bucket[slot] = bucket
+            self.count[slot] = 0
+            self.bytes[slot] = 0
+            start = slot * self.registers
+            self.hll[start:start + self.registers] = bytes(self.registers)
+            self.top[slot] = ()
+        return slot
+
+    def _freeze_top(self):
+        slot = self.open_bucket % self.slots
+        if self.bucket[slot] == self.open_bucket:
+            self.top[slot] = tuple((domain, stats.packets)
+                                   for domain, stats in self.open_top.top(self.top_k))
+        self.open_top.clear()
+
+    def add(self, bucket, count, nbytes, positions, domains):
+        """Add the totals, HLL positions and domain Counter of one group of records."""
+        if self.open_bucket is None or bucket > self.open_bucket:
+            if self.open_bucket is not None:
+                self._freeze_top()
+            self.open_bucket = bucket
+        slot = self._slot(bucket)
+        if slot is None:
+            return
+        self.count[slot] += count
+        self.bytes[slot] += nbytes
+        hll = self.hll
+        base = slot * self.registers
+        for index, rank in positions:
+            if rank > hll[base + index]:
+                hll[base + index] = rank
+        if bucket == self.open_bucket:
+            offer = self.open_top.offer
+            for domain, hits in domains.items():
+                offer(domain).packets += hits
+
+    def read(self, first, last):
+        """Copy buckets first..last as (bucket, count, bytes, registers, top) tuples."""
+        rows = []
+        registers = self.registers
+        for bucket in range(first, last + 1):
+            slot = bucket % self.slots
+            if self.bucket[slot] != bucket:
+                rows.append((bucket, 0, 0, None, ()))
+                continue
+            if bucket == self.open_bucket:
+                top = tuple((domain, stats.packets) for domain, stats in self.open_top.top(self.top_k))
+            else:
+                top = self.top[slot]
+            start = slot * registers
+            rows.append((bucket, self.count[slot], self.bytes[slot],
+                         bytes(self.hll[start:start + registers]), top))
+        return rows
+
+    def clear(self):
+        self.bucket = array("q", [-1]) * self.slots
+        self.open_bucket = None
+        self.open_top.clear()
+
+    def nbytes(self):
+        """Bytes of the fixed arrays plus the frozen top-domain lists."""
+        arrays = sum(column.buffer_info()[1] * column.itemsize
+                     for column in (self.bucket, self.count, self.bytes))
+        tops = sys.getsizeof(self.top) + sum(sys.getsizeof(top) for top in self.top if top)
+        return arrays + len(self.hll) + tops
+
+
+class Rollups:
+    def __init__(self, levels=((1, 3600), (60, 1440), (3600, 720)), precision=9,
+                 top_k=10, top_capacity=1000):
+        """``levels`` is a sequence of ``(step seconds, slots)``, finest first."""
+        self.precision = precision
+        self.levels = [RollupLevel(step, slots, precision, top_k, top_capacity)
+                       for step, slots in sorted(levels)]
+        self.lock = threading.Lock()
+
+    def add_many(self, records):
+        """Add ``(ts, ip, domain, proto, length)`` records."""
+        groups = {}
+        for ts, ip, domain, _, length in records:
+            second = int(ts)
+            group = groups.get(second)
+            if group is None:
+                group = groups[second] = [0, 0, set(), Counter()]
+            group[0] += 1
+            group[1] += length
+            group[2].add(ip)
+            group[3][domain] += 1
+        precision = self.precision
+        with self.lock:
+            for second, (count, nbytes, ips, domains) in sorted(groups.items()):
+                positions = [hll_position(ip, precision) for ip in ips]
+                for level in self.levels:
+                    level.add(second // level.step, count, nbytes, positions, domains)
+
+    def choose_level(self, start, end, max_points):
+        """The finest level holding start that needs at most max_points buckets.
+
+        If none fits, the coarsest level holding start (or the coarsest of
+        all) is used and its buckets are merged.
+        """
+        covering = [level for level in self.levels if level.covers(int(start // level.step))]
+        for level in covering:
+            if (end - start) / level.step <= max_points:
+                return level
+        return covering[-1] if covering else self.levels[-1]
+
+    def query(self, start, end, max_points=300, level=None, top=True):
+        """Return (level, bucket seconds, points) for the time range [start, end]."""
+        with self.lock:
+            if level is None:
+                level = self.choose_level(start, end, max_points)
+            first, last = int(start // level.step), int(end // level.step)
+            if level.open_bucket is not None:
+                # Older buckets are overwritten and newer ones don't exist yet
+                first = max(first, level.open_bucket - level.slots + 1)
+                last = min(last, level.open_bucket)
+            rows = level.read(first, last) if level.open_bucket is not None and first <= last else []
+        group = max(1, math.ceil(len(rows) / max_points))
+        points = []
+        for index in range(0, len(rows), group):
+            chunk = rows[index:index + group]
+            registers = None
+            domains = Counter()
+            for _, _, _, hll, top_domains in chunk:
+                if hll is not None:
+                    registers = hll if registers is None else bytes(map(max, registers, hll))
+                if top:
+                    domains.update(dict(top_domains))
+            point = {
+                "t": chunk[0][0] * level.step,
+                "count": sum(row[1] for row in chunk),
+                "bytes": sum(row[2] for row in chunk),
+                "unique_ips": hll_estimate(registers) if registers is not None else 0,
+            }
+            if top:
+                point["top_domains"] = domains.most_common(level.top_k)
+            points.append(point)
+        return level, level.step * group, points
+
+    def clear(self):
+        with self.lock:
+            for level in self.levels:
+                level.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hll_precision": self.precision,
+                "levels": [{"step": level.step, "slots": level.slots, "retention_seconds": level.retention,
+                            "newest_bucket": level.open_bucket, "bytes": level.nbytes()}
+                           for level in self.levels],
+            }
@@ -0,0 +1,315 @@
+"""Server-side filters for Socket.IO log subscriptions.
+
+A client subscribes with a filter:
+
+    {"domains": [...], "ips": [...], "exclude_domains": [...], "exclude_ips": [...]}
+
+and then only receives entries whose domain matches one of ``domains``
+(if any are given), whose source IP is in one of ``ips`` (if any), and
+that match none of the exclusions.  Clients with the same filter share a
+room, and matching is done once per room.
+
+Domain patterns:
+
+    example.com        example.com and all of its subdomains
+    =example.com       example.com only
+    *.example.com      subdomains of example.com, not example.com itself
+    *                  every domain
+    api.*.example.com  "*" as a whole label matches exactly one label
+    ads*.example.com   other globs are fnmatch patterns on the labels left
+                       of the fixed suffix ("ads1", "ads.cdn", ...)
+    *.ads*.example.com the glob with at least one more label to its left
+    =ads*.example.com  the glob with no extra labels: each of its labels
+                       matches exactly one label ("ads1", not "ads.cdn")
+
+IP patterns are addresses or CIDR blocks, IPv4 or IPv6.
+
+All patterns of all rooms are compiled into one ``FilterIndex``: a trie
+over reversed domain labels and a binary prefix tree per IP version.  A
+lookup walks one path through each, so its cost depends on the length of
+the domain and of the longest registered prefix, not on the number of
+rooms.  Lookups are cached per domain and per IP.
+"""
+import fnmatch
+import hashlib
+import ipaddress
+import json
+import re
+import threading
+
+MAX_PATTERNS = 1000  # per list, per subscription
+CACHE_SIZE = 65536
+
+FILTER_FIELDS = ("domains", "ips", "exclude_domains", "exclude_ips")
+
+
+def normalize_filter(spec):
+    """Validate a subscription filter and return it in canonical form.
+
+    Raises ValueError with a message suitable for the client.
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("filter must be an object")
+    unknown = set(spec) - set(FILTER_FIELDS)
+    if unknown:
+        raise ValueError(f"unknown filter fields: {', '.join(sorted(unknown))}")
+    result = {}
+    for field in FILTER_FIELDS:
+        values = spec.get(field) or []
+        if isinstance(values, str):
+            values = [values]
+        if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+            raise ValueError(f"{field} must be a list of strings")
+        if len(values) > MAX_PATTERNS:
+            raise ValueError(f"{field} has more than {MAX_PATTERNS} patterns")
+        if field.endswith("ips"):
+            try:
+                cleaned = {str(ipaddress.ip_network(v.strip(), strict=False)) for v in values}
+            except ValueError as e:
+                raise ValueError(f"invalid {field} entry: {e}")
+        else:
+            cleaned = set()
+            for value in values:
+                pattern = value.strip().rstrip(".").lower()
+                # Every label must be non-empty, so "", "=", ".." and "a..b" are refused
+                if "" in pattern.lstrip("=").split("."):
+                    raise ValueError(f"invalid {field} entry: {value!r}")
+                cleaned.add(pattern)
+        result[field] = sorted(cleaned)
+    return result
+
+
+def room_for(spec):
+    """Room name shared by every client with this (canonical) filter."""
+    digest = hashlib.sha1(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()
+    return f"filter:{digest[:16]}"
+
+
+# ============================================================================
+# DOMAIN SUFFIX TRIE
+# ============================================================================
+class _LabelNode:
+    __slots__ = ("children", "suffix", "below", "exact", "globs")
+
+    def __init__(self):
+        self.children = {}  # label -> _LabelNode; "*" matches any one label
+        self.suffix = []    # keys matching this name and everything below it
+        self.below = []     # keys matching strictly below this name
+        self.exact = []     # keys matching this name only
+        self.globs = []     # (regex on the remaining left labels, or one regex per label, key)
+
+
+class DomainTrie:
+    def __init__(self):
+        self.root = _LabelNode()
+
+    def add(self, pattern, key):
+        exact = pattern.startswith("=")
+        labels = pattern.lstrip("=").split(".")
+        glob = None
+        below = False
+        if not exact and labels[0] == "*" and len(labels) > 1:
+            below = True
+            labels = labels[1:]
+        # The fixed suffix starts right of the rightmost label that is a partial glob
+        partial = [index for index, label in enumerate(labels)
+                   if label != "*" and any(c in label for c in "*?[")]
+        if partial:
+            glob = ".".join(labels[:partial[-1] + 1])
+            labels = labels[partial[-1] + 1:]
+        node = self.root
+        for label in reversed(labels):
+            node = node.children.setdefault(label, _LabelNode())
+        if glob is not None:
+            if exact:
+                matcher = tuple(re.compile(fnmatch.translate(label)) for label in glob.split("."))
+            elif below:
+                matcher = re.compile(r"(?s:.+\.)" + fnmatch.translate(glob))
+            else:
+                matcher = re.compile(fnmatch.translate(glob))
+            node.globs.append((matcher, key))
+        elif exact:
+            node.exact.append(key)
+        elif below:
+            node.below.append(key)
+        else:
+            node.suffix.append(key)
+
+    def match(self, domain):
+        """Return the set of keys whose pattern matches domain."""
+        labels = domain.rstrip(".").lower().split(".")
+        depth = len(labels)
+        matched = set()
+        stack = [(self.root, 0)]
+        while stack:
+            node, consumed = stack.pop()
+            remaining = depth - consumed
+            matched.update(node.suffix)
+            if remaining:
+                matched.update(node.below)
+                if node.globs:
+                    left = ".".join(labels[:remaining])
+                    for matcher, key in node.globs:
+                        if isinstance(matcher, tuple):
+                            if len(matcher) == remaining and all(
+                                    regex.match(label) for regex, label in zip(matcher, labels)):
+                                matched.add(key)
+                        elif matcher.match(left):
+                            matched.add(key)
+                label = labels[remaining - 1]
+                child = node.children.get(label)
+                if child is not None:
+                    stack.append((child, consumed + 1))
+                wildcard = node.children.get("*")
+                if wildcard is not None:
+                    stack.append((wildcard, consumed + 1))
+            else:
+                matched.update(node.exact)
+        return matched
+
+
+# ============================================================================
+# CIDR PREFIX TREE
+# ============================================================================
+class PrefixTree:
+    """Binary trie over address bits; one per IP version."""
+
+    def __init__(self, bits):
+        self.bits = bits
+        self.root = [None, None, []]  # [zero child, one child, keys]
+        self.max_prefix = -1
+
+    def add(self, network, key):
+        node = self.root
+        value = int(network.network_address)
+        for position in range(network.prefixlen):
+            bit = (value >> (self.bits - 1 - position)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, []]
+            node = node[bit]
+        node[2].append(key)
+        self.max_prefix = max(self.max_prefix, network.prefixlen)
+
+    def match(self, address):
+        matched = set(self.root[2])
+        node = self.root
+        value = int(address)
+        for position in range(self.max_prefix):
+            node = node[(value >> (self.bits - 1 - position)) & 1]
+            if node is None:
+                break
+            matched.update(node[2])
+        return matched
+
+
+# ============================================================================
+# COMPILED INDEX
+# ============================================================================
+class FilterIndex:
+    """Immutable index over the filters of a set of rooms."""
+
+    def __init__(self, filters):
+        self.rooms = frozenset(filters)
+        self.domains = DomainTrie()
+        self.excluded_domains = DomainTrie()
+        self.networks = {4: PrefixTree(32), 6: PrefixTree(128)}
+        self.excluded_networks = {4: PrefixTree(32), 6: PrefixTree(128)}
+        any_domain, any_ip = set(), set()
+        for room, spec in filters.items():
+            for pattern in spec["domains"]:
+                self.domains.add(pattern, room)
+            for pattern in spec["exclude_domains"]:
+                self.excluded_domains.add(pattern, room)
+            for network in map(ipaddress.ip_network, spec["ips"]):
+                self.networks[network.version].add(network, room)
+            for network in map(ipaddress.ip_network, spec["exclude_ips"]):
+                self.excluded_networks[network.version].add(network, room)
+            if not spec["domains"]:
+                any_domain.add(room)
+            if not spec["ips"]:
+                any_ip.add(room)
+        self.any_domain = frozenset(any_domain)
+        self.any_ip = frozenset(any_ip)
+        self._domain_cache = {}
+        self._ip_cache = {}
+
+    def _domain_rooms(self, domain):
+        rooms = self._domain_cache.get(domain)
+        if rooms is None:
+            rooms = (self.domains.match(domain) | self.any_domain) - self.excluded_domains.match(domain)
+            if len(self._domain_cache) >= CACHE_SIZE:
+                self._domain_cache.clear()
+            self._domain_cache[domain] = rooms
+        return rooms
+
+    def _ip_rooms(self, ip):
+        rooms = self._ip_cache.get(ip)
+        if rooms is None:
+            try:
+                address = ipaddress.ip_address(ip)
+            except ValueError:
+                rooms = frozenset()
+            else:
+                version = address.version
+                rooms = ((self.networks[version].match(address) | self.any_ip)
+                         - self.excluded_networks[version].match(address))
+            if len(self._ip_cache) >= CACHE_SIZE:
+                self._ip_cache.clear()
+            self._ip_cache[ip] = rooms
+        return rooms
+
+    def match(self, ip, domain):
+        """Return the set of rooms an entry from ip for domain belongs to."""
+        return self._domain_rooms(domain) & self._ip_rooms(ip)
+
+
+class SubscriptionRegistry:
+    """Tracks which client is in which filter room and keeps the index current."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._filters = {}  # room -> canonical filter
+        self._members = {}  # room -> set of sids
+        self._rooms = {}    # sid -> room
+        self.index = FilterIndex({})
+
+    def subscribe(self, sid, spec):
+        """Put sid in the room for spec; returns ``(room, previous room)``."""
+        spec = normalize_filter(spec)
+        room = room_for(spec)
+        with self._lock:
+            previous = self._rooms.get(sid)
+            if previous == room:
+                return room, previous
+            self._leave(sid)
+            self._rooms[sid] = room
+            self._members.setdefault(room, set()).add(sid)
+            if room not in self._filters:
+                self._filters[room] = spec
+                self.index = FilterIndex(self._filters)
+        return room, previous
+
+    def unsubscribe(self, sid):
+        """Remove sid from its room; returns the room it was in, if any."""
+        with self._lock:
+            return self._leave(sid)
+
+    def _leave(self, sid):
+        room = self._rooms.pop(sid, None)
+        if room is None:
+            return None
+        members = self._members[room]
+        members.discard(sid)
+        if not members:
+            del self._members[room]
+            del self._filters[room]
+            self.index = FilterIndex(self._filters)
+        return room
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rooms": len(self._filters),
+                "subscribers": len(self._rooms),
+                "patterns": sum(len(values) for spec in self._filters.values() for values in spec.values()),
+            }
@@ -0,0 +1,67 @@
+"""Every pattern form in the subscriptions.py docstring, checked against the trie."""
+import pytest
+
+from subscriptions import DomainTrie, FilterIndex, normalize_filter
+
+DOMAIN_CASES = [
+    # pattern, domain, matches
+    ("example.com", "example.com", True),
+    ("example.com", "www.example.com", True),
+    ("example.com", "a.b.example.com", True),
+    ("example.com", "notexample.com", False),
+    ("=example.com", "example.com", True),
+    ("=example.com", "www.example.com", False),
+    ("*.example.com", "www.example.com", True),
+    ("*.example.com", "a.b.example.com", True),
+    ("*.example.com", "example.com", False),
+    ("*", "example.com", True),
+    ("*", "com", True),
+    ("api.*.example.com", "api.eu.example.com", True),
+    ("api.*.example.com", "api.eu.west.example.com", False),
+    ("api.*.example.com", "api.example.com", False),
+    ("api.*.example.com", "x.api.eu.example.com", True),
+    ("ads*.example.com", "ads1.example.com", True),
+    ("ads*.example.com", "ads.cdn.example.com", True),
+    ("ads*.example.com", "ads.example.com", True),
+    ("ads*.example.com", "x.ads1.example.com", False),
+    ("ads*.example.com", "example.com", False),
+    ("*.ads*.example.com", "x.ads1.example.com", True),
+    ("*.ads*.example.com", "a.b.ads1.example.com", True),
+    ("*.ads*.example.com", "ads1.example.com", False),
+    ("*.ads*.example.com", "ads.cdn.example.com", False),
+    ("=ads*.example.com", "ads1.example.com", True),
+    ("=ads*.example.com", "ads.cdn.example.com", False),
+    ("=ads*.example.com", "x.ads1.example.com", False),
+    ("=ads?.example.com", "ads1.example.com", True),
+    ("=ads?.example.com", "ads12.example.com", False),
+]
+
+
+@pytest.mark.parametrize("pattern, domain, matches", DOMAIN_CASES)
+def test_domain_patterns(pattern, domain, matches):
+    trie = DomainTrie()
+    (pattern,) = normalize_filter({"domains": [pattern]})["domains"]
+    trie.add(pattern, "room")
+    assert (trie.match(domain) == {"room"}) is matches
+
+
+IP_CASES = [
+    ("10.0.0.1", "10.0.0.1", True),
+    ("10.0.0.1", "10.0.0.2", False),
+    ("10.0.0.0/8", "10.200.1.1", True),
+    ("10.0.0.0/8", "11.0.0.1", False),
+    ("2001:db8::/32", "2001:db8::1", True),
+    ("2001:db8::/32", "10.0.0.1", False),
+]
+
+
+@pytest.mark.parametrize("pattern, ip, matches", IP_CASES)
+def test_ip_patterns(pattern, ip, matches):
+    index = FilterIndex({"room": normalize_filter({"ips": [pattern]})})
+    assert (index.match(ip, "example.com") == {"room"}) is matches
+
+
+@pytest.mark.parametrize("pattern", ["", "=", "..", "a..b", ".example.com"])
+def test_empty_labels_are_refused(pattern):
+    with pytest.raises(ValueError):
+        normalize_filter({"domains": [pattern]})